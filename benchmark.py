@@ -0,0 +1,145 @@
+import argparse
+import contextlib
+import gc
+import json
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+
+import dataloader
+import find_scooters_without_IDs_paper
+import pathfinder
+import synthetic_data
+import trip_extractor_full_data
+import utilities
+
+
+# times every stage of the pipeline on synthetic fleets of different sizes (see synthetic_data.py) and estimates how
+# each stage scales: the exponent k of runtime ~ fleet_size^k (log-log fit over the fleet sizes).
+
+STAGES = ["load", "load_cached", "remove_standing_scooters", "remove_slightly_moving_scooters", "remove_loading_scooters",
+          "find_scooter_trip_candidates", "find_trips_by_stable_state", "identify_trips_full_data"]
+
+def benchmark_folder(folder: str) -> dict:
+    # runs the pipeline on one folder and returns the runtime [sec] of every stage and the sizes of the intermediate
+    # results. identify_trips_full_data is only timed if the street network is stored offline (else it is None), it
+    # routes without the persistent street distance cache, so earlier runs and fleet sizes do not shorten it.
+    result = {}
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        # load: parsing the json-files (cold), load_cached: the memory-mapped snapshot cache of the folder (warm, as in
+        # every later run of the main script). the cache is written in between, that is not part of both stages.
+        start_time = time.perf_counter()
+        recordings_lst, id_lst = dataloader.load_all_files_columnar(folder)
+        collection_lst = dataloader.columnar_2_observations(recordings_lst, id_lst)
+        result['load'] = time.perf_counter() - start_time
+        dataloader.load_all_files_cached(folder)
+        start_time = time.perf_counter()
+        recordings_lst, id_lst = dataloader.load_all_files_cached(folder)
+        collection_lst = dataloader.columnar_2_observations(recordings_lst, id_lst)
+        result['load_cached'] = time.perf_counter() - start_time
+        result['snapshots'] = len(collection_lst)
+        result['observations'] = sum([len(scooters) for _, scooters in collection_lst])
+
+        # the same steps as make_appearing_disappearing_lists(), but with a separate time for both removals
+        appear_lst = []
+        disappear_lst = []
+        standing_time = 0
+        moving_time = 0
+        for i in range(len(collection_lst)-1):
+            time1, lst1 = collection_lst[i]
+            time2, lst2 = collection_lst[i+1]
+            start_time = time.perf_counter()
+            lst1, lst2 = find_scooters_without_IDs_paper.remove_standing_scooters(lst1[:], lst2[:])
+            standing_time += time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            lst1, lst2 = find_scooters_without_IDs_paper.remove_slightly_moving_scooters(lst1, lst2)
+            moving_time += time.perf_counter() - start_time
+            disappear_lst.append((time1, lst1))
+            appear_lst.append((time2, lst2))
+        result['remove_standing_scooters'] = standing_time
+        result['remove_slightly_moving_scooters'] = moving_time
+
+        start_time = time.perf_counter()
+        appear_lst, disappear_lst = find_scooters_without_IDs_paper.remove_loading_scooters(appear_lst, disappear_lst)
+        result['remove_loading_scooters'] = time.perf_counter() - start_time
+        result['disappearing_scooters'] = sum([len(scooters) for _, scooters in disappear_lst])
+
+        start_time = time.perf_counter()
+        trip_candidates_lst = find_scooters_without_IDs_paper.find_scooter_trip_candidates(appear_lst, disappear_lst)
+        result['find_scooter_trip_candidates'] = time.perf_counter() - start_time
+        result['trip_candidates'] = len(trip_candidates_lst)
+        result['candidate_edges'] = sum([len(end_lst) for _, end_lst in trip_candidates_lst])
+
+        start_time = time.perf_counter()
+        trips_identified, _ = utilities.find_trips_by_stable_state(trip_candidates_lst)
+        result['find_trips_by_stable_state'] = time.perf_counter() - start_time
+        result['trips_identified'] = len(trips_identified)
+
+        result['identify_trips_full_data'] = None
+        if os.path.exists(pathfinder.DEFAULT_GRAPH_FILE):
+            pathfinder.load_graph()  # loading the street network is not part of the stage
+            all_day = dataloader.columnar_2_dicts(recordings_lst, id_lst)
+            start_time = time.perf_counter()
+            trip_extractor_full_data.identify_trips_full_data(all_day, cache_file=None)
+            result['identify_trips_full_data'] = time.perf_counter() - start_time
+    return result
+
+def scaling_exponents(results: {int: dict}) -> dict:
+    # the exponent k of runtime ~ fleet_size^k for every stage (None if there are less than two measurements)
+    exponents = {}
+    fleet_sizes = sorted(results.keys())
+    for stage in STAGES:
+        points = [(fleet_size, results[fleet_size][stage]) for fleet_size in fleet_sizes
+                  if results[fleet_size][stage] is not None and results[fleet_size][stage] > 0]
+        if len(points) < 2:
+            exponents[stage] = None
+            continue
+        slope, _ = np.polyfit(np.log([p[0] for p in points]), np.log([p[1] for p in points]), 1)
+        exponents[stage] = float(slope)
+    return exponents
+
+def run_benchmark(fleet_sizes: [int], hours: float = 4, snapshot_interval: int = 60, work_dir: str = None,
+                  keep: bool = False, seed: int = 0) -> dict:
+    remove_work_dir = work_dir is None and not keep
+    if work_dir is None:
+        work_dir = tempfile.mkdtemp(prefix="scooter_benchmark_")
+    results = {}
+    # the objects of the imported modules (osmnx, pandas, ...) are never collected, without freezing them the first full
+    # garbage collection scans all of them inside of whatever stage is timed at that moment
+    gc.collect()
+    gc.freeze()
+    try:
+        for fleet_size in fleet_sizes:
+            folder = os.path.join(work_dir, f"fleet_{fleet_size}")
+            if not os.path.isdir(folder):
+                synthetic_data.generate_fleet_day(folder, fleet_size=fleet_size, hours=hours,
+                                                  snapshot_interval=snapshot_interval, seed=seed)
+            results[fleet_size] = benchmark_folder(folder)
+            stage_times = ", ".join([f"{stage}: {results[fleet_size][stage]:.2f}s" for stage in STAGES
+                                     if results[fleet_size][stage] is not None])
+            print(f"fleet_size {fleet_size} ({results[fleet_size]['observations']} observations): {stage_times}")
+    finally:
+        if remove_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    exponents = scaling_exponents(results)
+    print("scaling exponents (runtime ~ fleet_size^k): " +
+          ", ".join([f"{stage}: {k:.2f}" for stage, k in exponents.items() if k is not None]))
+    return {'hours': hours, 'snapshot_interval': snapshot_interval, 'results': results, 'scaling_exponents': exponents}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Time the stages of the pipeline on synthetic fleets of different sizes.")
+    parser.add_argument("--fleet-sizes", type=int, nargs="+", default=[100, 200, 400, 800])
+    parser.add_argument("--hours", type=float, default=4, help="recorded time span of every synthetic fleet")
+    parser.add_argument("--snapshot-interval", type=int, default=60, help="[sec]")
+    parser.add_argument("--work-dir", default=None, help="folder for the synthetic data (re-used if it exists), default: a temporary folder")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary synthetic data")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the results as json into this file")
+    args = parser.parse_args()
+    report = run_benchmark(args.fleet_sizes, hours=args.hours, snapshot_interval=args.snapshot_interval,
+                           work_dir=args.work_dir, keep=args.keep, seed=args.seed)
+    if args.output is not None:
+        with open(args.output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
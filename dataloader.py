@@ -1,8 +1,15 @@
 import json
 import datetime
+import calendar
+import functools
+import time
+import numpy as np
 from pytz import timezone
 import os
+import sys
 from os import listdir
+from typing import NamedTuple
+from concurrent.futures import ProcessPoolExecutor
 
 
 # data format:
@@ -30,6 +37,60 @@ from os import listdir
 
 # load the .json files into a dict[id:scooter] where scooter is a dict with the attributes and the ID.
 
+# columnar format (alternative to the dicts): one numpy structured array per snapshot with one row per scooter and only
+# the attributes used by the algorithms. the scooter-IDs are stored as index into a separate id-list.
+SCOOTER_DTYPE = np.dtype([
+    ('id_index', np.int32),
+    ('lat', np.float64),
+    ('lng', np.float64),
+    ('batteryLevel', np.int16),
+    ('currentRangeMeters', np.int32),
+    ('lastLocationUpdate_utc', np.int64),  # real utc-timestamp of the string (to re-build it)
+    ('lastStateChange_utc', np.int64),
+    ('lastLocationUpdate_timestamp', np.float64),  # the same values as in the dicts
+    ('lastStateChange_timestamp', np.float64),
+    ('collection_timestamp_utc', np.int64),
+])
+
+
+# record format (alternative to the dicts): one immutable Observation per scooter and snapshot with only the attributes
+# used by the algorithms (and the ID for the ground-truth checks). sanitize_data() converts the loaded dicts, the
+# records can also be read like the dicts (scooter['lat'] is scooter.lat). lastLocationUpdate (the string) is only
+# known when the record was made from the raw data.
+class Observation(NamedTuple):
+    id: str
+    lat: float
+    lng: float
+    batteryLevel: int
+    collection_timestamp_utc: int
+    lastLocationUpdate_timestamp: float
+    lastStateChange_timestamp: float
+    lastLocationUpdate: str = None
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return getattr(self, key)
+        return tuple.__getitem__(self, key)
+
+
+BERLIN = timezone("Europe/Berlin")
+
+
+def __parse_time_string(time_string: str) -> datetime.datetime:
+    # fast version of datetime.datetime.strptime(time_string, '%Y-%m-%dT%H:%M:%SZ') for "2023-09-30T21:22:03Z".
+    # other formats are given to strptime (which also raises the errors)
+    if (len(time_string) == 20 and time_string[4] == '-' and time_string[7] == '-' and time_string[10] == 'T' and
+            time_string[13] == ':' and time_string[16] == ':' and time_string[19] == 'Z'):
+        return datetime.datetime(int(time_string[0:4]), int(time_string[5:7]), int(time_string[8:10]),
+                                 int(time_string[11:13]), int(time_string[14:16]), int(time_string[17:19]))
+    return datetime.datetime.strptime(time_string, '%Y-%m-%dT%H:%M:%SZ')
+
+def __parse_filename_time(filename_time: str) -> datetime.datetime:
+    # fast version of datetime.datetime.strptime(filename_time, '%Y%m%d-%H%M%S') for "20231001-000251"
+    if len(filename_time) == 15 and filename_time[8] == '-' and filename_time.replace('-', '').isdigit():
+        return datetime.datetime(int(filename_time[0:4]), int(filename_time[4:6]), int(filename_time[6:8]),
+                                 int(filename_time[9:11]), int(filename_time[11:13]), int(filename_time[13:15]))
+    return datetime.datetime.strptime(filename_time, '%Y%m%d-%H%M%S')
 
 def filename_2_date(filename: str) -> (str, int) :
     # /home/eric/Lehre/TIER paper/data_2023_10_01/vehicles-20231001-000251.json
@@ -41,18 +102,27 @@ def filename_2_date(filename: str) -> (str, int) :
         print(filename[-5:])
         raise Exception(f"Wrong filename, missing '.json'! Expected 'vehicles-date-time.json', got: {filename}")
     filename = filename[9:-5]
-    time_object1 = datetime.datetime.strptime(filename, '%Y%m%d-%H%M%S')
+    time_object1 = __parse_filename_time(filename)
     date_human = str(time_object1)
     utc_timestamp = int(time_object1.timestamp())
     return date_human, utc_timestamp
 
+@functools.lru_cache(maxsize=2**16)  # most lastStateChange strings repeat in many snapshots
 def llu_lsc_2_timestamp(time_string: str) -> int:
     # Datetime assumes it is local time, but it is utc, so we have to add the UTC-offset!
-    time_object1 = datetime.datetime.strptime(time_string, '%Y-%m-%dT%H:%M:%SZ')  # 2023-09-30T21:22:03Z
-    time_object2 = datetime.datetime.fromtimestamp(time_object1.timestamp(), tz=timezone("Europe/Berlin"))
-    time_object3 = datetime.datetime.fromtimestamp(time_object1.timestamp() + time_object2.utcoffset().seconds, tz=timezone("Europe/Berlin"))
+    time_object1 = __parse_time_string(time_string)  # 2023-09-30T21:22:03Z
+    time_object2 = datetime.datetime.fromtimestamp(time_object1.timestamp(), tz=BERLIN)
+    time_object3 = datetime.datetime.fromtimestamp(time_object1.timestamp() + time_object2.utcoffset().seconds, tz=BERLIN)
     return time_object3.timestamp()
 
+def llu_lsc_2_timestamps(time_strings: [str]) -> np.ndarray:
+    # bulk version of llu_lsc_2_timestamp(): every distinct string is converted only once
+    if len(time_strings) == 0:
+        return np.zeros(0)
+    unique_strings, inverse = np.unique(np.asarray(time_strings), return_inverse=True)
+    unique_timestamps = np.array([llu_lsc_2_timestamp(str(time_string)) for time_string in unique_strings])
+    return unique_timestamps[inverse.reshape(-1)]
+
 
 def load_scooters_from_json(filename: str) -> (int, dict):
     date_human, date_utc = filename_2_date(filename)
@@ -72,32 +142,289 @@ def load_scooters_from_json(filename: str) -> (int, dict):
         scooters_dict[id] = attributes
     return date_utc, scooters_dict
 
-def load_all_files(folder: str) -> [(int, dict)]:
-    recordings_lst = [] # [(int, dict)]
+def __list_vehicle_files(folder: str) -> [str]:
+    # returns the full filenames of all 'vehicles-date-time.json' files in the folder
     if not os.path.isdir(folder):
         raise Exception(f"Requires a folder!")
     if folder[-1] != "/":
         folder = folder + "/"
+    filename_lst = []
     all_folder_content = listdir(folder)
     for item in all_folder_content:
         full_filename = folder + item
         if not os.path.isfile(full_filename):
             continue
         if (item[-5:] == ".json") and (item[:8] == "vehicles"):
-            date_utc, scooter_dict = load_scooters_from_json(full_filename)
-            if type(date_utc) != int:
-                print(f"WTF! {type(date_utc): {date_utc}}")
-            recordings_lst.append((date_utc, scooter_dict))
+            filename_lst.append(full_filename)
+    return filename_lst
+
+def __map_files(load_function, filename_lst: [str], workers: int) -> list:
+    # applies the load_function to all files. with workers > 1 the files are parsed in a process pool, the results
+    # keep the order of filename_lst
+    if workers > 1 and len(filename_lst) > 1:
+        chunksize = max(1, len(filename_lst) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(load_function, filename_lst, chunksize=chunksize))
+    return [load_function(filename) for filename in filename_lst]
+
+def __load_files(filename_lst: [str], workers: int) -> [(int, dict)]:
+    recordings_lst = [] # [(int, dict)]
+    for date_utc, scooter_dict in __map_files(load_scooters_from_json, filename_lst, workers):
+        if type(date_utc) != int:
+            print(f"WTF! {type(date_utc): {date_utc}}")
+        recordings_lst.append((date_utc, scooter_dict))
     recordings_lst = sorted(recordings_lst, key=lambda x: x[0])
     return recordings_lst
 
-def load_multiple_folders(folder_lst: [str]) -> [(int, dict)]:
-    recordings_lst = []
+def load_all_files(folder: str, workers: int = 1) -> [(int, dict)]:
+    # workers: number of processes that parse the files in parallel (1 = sequential)
+    return __load_files(__list_vehicle_files(folder), workers)
+
+def iter_all_files(folder: str):
+    # generator version of load_all_files(): yields the snapshots (timestamp, {id: scooter_dict}) sorted by time, but
+    # only one snapshot is loaded at a time
+    filename_lst = sorted(__list_vehicle_files(folder), key=lambda filename: filename_2_date(filename)[1])
+    for full_filename in filename_lst:
+        yield load_scooters_from_json(full_filename)
+
+def load_first_and_last_file(folder: str) -> [(int, dict)]:
+    # only the first and the last snapshot of the folder (e.g. for the transition to the previous and the next day),
+    # an empty list if there are no files
+    filename_lst = sorted(__list_vehicle_files(folder), key=lambda filename: filename_2_date(filename)[1])
+    if len(filename_lst) == 0:
+        return []
+    return [load_scooters_from_json(filename_lst[0]), load_scooters_from_json(filename_lst[-1])]
+
+def load_multiple_folders(folder_lst: [str], workers: int = 1) -> [(int, dict)]:
+    # the files of all folders are loaded together, so the workers are also used across the folder borders
+    filename_lst = []
     for folder in folder_lst:
-        temp_lst = load_all_files(folder)
-        recordings_lst.extend(temp_lst)
+        filename_lst.extend(__list_vehicle_files(folder))
+    return __load_files(filename_lst, workers)
+
+@functools.lru_cache(maxsize=2**16)
+def time_string_2_utc(time_string: str) -> int:
+    # the real utc-timestamp of "2023-09-30T21:22:03Z" (independent of the local timezone)
+    return calendar.timegm(__parse_time_string(time_string).timetuple())
+
+def __time_strings_2_utc(time_strings: [str]) -> np.ndarray:
+    if len(time_strings) == 0:
+        return np.zeros(0, dtype=np.int64)
+    unique_strings, inverse = np.unique(np.asarray(time_strings), return_inverse=True)
+    unique_timestamps = np.array([time_string_2_utc(str(time_string)) for time_string in unique_strings], dtype=np.int64)
+    return unique_timestamps[inverse.reshape(-1)]
+
+@functools.lru_cache(maxsize=2**16)  # the same string object for the repeating timestamps
+def utc_2_time_string(utc_timestamp: int) -> str:
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(utc_timestamp))
+
+def load_scooters_from_json_columnar(filename: str, id_dict: dict[str, int], id_lst: [str]) -> (int, np.ndarray):
+    # like load_scooters_from_json(), but returns a structured array (SCOOTER_DTYPE). new scooter-IDs are appended to
+    # id_lst and id_dict (id -> index in id_lst)
+    date_human, date_utc = filename_2_date(filename)
+    with open(filename) as json_file:
+        json_data = json.load(json_file)
+    scooters_lst = json_data['data']
+    snapshot = np.empty(len(scooters_lst), dtype=SCOOTER_DTYPE)
+    id_indices = []
+    for scooter_dict in scooters_lst:
+        id = scooter_dict['id']
+        if id not in id_dict:
+            id_dict[id] = len(id_lst)
+            id_lst.append(id)
+        id_indices.append(id_dict[id])
+    attributes_lst = [scooter_dict['attributes'] for scooter_dict in scooters_lst]
+    llu_strings = [attributes['lastLocationUpdate'] for attributes in attributes_lst]
+    lsc_strings = [attributes['lastStateChange'] for attributes in attributes_lst]
+    snapshot['id_index'] = id_indices
+    snapshot['lat'] = [attributes['lat'] for attributes in attributes_lst]
+    snapshot['lng'] = [attributes['lng'] for attributes in attributes_lst]
+    snapshot['batteryLevel'] = [attributes['batteryLevel'] for attributes in attributes_lst]
+    snapshot['currentRangeMeters'] = [attributes['currentRangeMeters'] for attributes in attributes_lst]
+    snapshot['lastLocationUpdate_utc'] = __time_strings_2_utc(llu_strings)
+    snapshot['lastStateChange_utc'] = __time_strings_2_utc(lsc_strings)
+    snapshot['lastLocationUpdate_timestamp'] = llu_lsc_2_timestamps(llu_strings)
+    snapshot['lastStateChange_timestamp'] = llu_lsc_2_timestamps(lsc_strings)
+    snapshot['collection_timestamp_utc'] = date_utc
+    return date_utc, snapshot
+
+def __load_scooters_from_json_columnar_own_ids(filename: str) -> (int, np.ndarray, [str]):
+    # for the process pool: every file gets its own id-list, they are merged afterward
+    id_lst = []
+    date_utc, snapshot = load_scooters_from_json_columnar(filename, {}, id_lst)
+    return date_utc, snapshot, id_lst
+
+def load_all_files_columnar(folder: str, workers: int = 1) -> ([(int, np.ndarray)], [str]):
+    # returns the snapshots [(collection_timestamp, structured_array)] sorted by time and the list of all scooter-IDs
+    # workers: number of processes that parse the files in parallel (1 = sequential)
+    recordings_lst = []
+    id_dict = {}
+    id_lst = []
+    filename_lst = __list_vehicle_files(folder)
+    if workers > 1:
+        for date_utc, snapshot, file_id_lst in __map_files(__load_scooters_from_json_columnar_own_ids, filename_lst, workers):
+            # translate the id-indices of the file into the common id-list
+            for id in file_id_lst:
+                if id not in id_dict:
+                    id_dict[id] = len(id_lst)
+                    id_lst.append(id)
+            translation = np.array([id_dict[id] for id in file_id_lst], dtype=np.int32)
+            snapshot['id_index'] = translation[snapshot['id_index']]
+            recordings_lst.append((date_utc, snapshot))
+    else:
+        for full_filename in filename_lst:
+            date_utc, snapshot = load_scooters_from_json_columnar(full_filename, id_dict, id_lst)
+            recordings_lst.append((date_utc, snapshot))
     recordings_lst = sorted(recordings_lst, key=lambda x: x[0])
-    return recordings_lst
+    return recordings_lst, id_lst
+
+def columnar_2_dicts(recordings_lst: [(int, np.ndarray)], id_lst: [str]) -> [(int, dict)]:
+    # adapter for the dict-based functions: returns the same shape as load_all_files() [(timestamp, {id: scooter_dict})],
+    # but the scooter-dicts only contain the attributes of the columnar format
+    output_lst = []
+    for date_utc, snapshot in recordings_lst:
+        date_human = str(datetime.datetime.fromtimestamp(date_utc))
+        scooters_dict = {}
+        for row in snapshot.tolist():
+            (id_index, lat, lng, battery, range_meters, llu_utc, lsc_utc, llu_timestamp, lsc_timestamp, cts) = row
+            id = id_lst[id_index]
+            scooters_dict[id] = {'id': id,
+                                 'lat': lat,
+                                 'lng': lng,
+                                 'batteryLevel': battery,
+                                 'currentRangeMeters': range_meters,
+                                 'lastLocationUpdate': utc_2_time_string(llu_utc),
+                                 'lastStateChange': utc_2_time_string(lsc_utc),
+                                 'collection_timestamp_human': date_human,
+                                 'collection_timestamp_utc': cts,
+                                 'lastLocationUpdate_timestamp': llu_timestamp,
+                                 'lastStateChange_timestamp': lsc_timestamp}
+        output_lst.append((date_utc, scooters_dict))
+    return output_lst
+
+def dict_2_observation(scooter: dict) -> Observation:
+    # the IDs and time-strings repeat in every snapshot, so they are shared between the records
+    last_location_update = scooter.get('lastLocationUpdate')
+    if last_location_update is not None:
+        last_location_update = sys.intern(last_location_update)
+    return Observation(sys.intern(scooter['id']), scooter['lat'], scooter['lng'], scooter['batteryLevel'],
+                       scooter['collection_timestamp_utc'], scooter['lastLocationUpdate_timestamp'],
+                       scooter['lastStateChange_timestamp'], last_location_update)
+
+def dicts_2_observations(scooters: list) -> [Observation]:
+    # converts a list of scooter-dicts (records stay as they are). a list of records is returned unchanged (the same
+    # list), so in-place changes of the list are still seen by the caller
+    for scooter in scooters:
+        if type(scooter) is not Observation:
+            break
+    else:
+        return scooters
+    return [scooter if type(scooter) is Observation else dict_2_observation(scooter) for scooter in scooters]
+
+def snapshots_2_observations(snapshot_lst: [(int, list)]) -> [(int, [Observation])]:
+    # [(timestamp, [scooter_dict])] -> [(timestamp, [Observation])], e.g. for the appearing/disappearing lists
+    return [(timestamp, dicts_2_observations(scooters)) for timestamp, scooters in snapshot_lst]
+
+def candidates_2_observations(trip_candidates: [(dict, list)]) -> [(Observation, [Observation])]:
+    # [(start_scooter, [end_scooters])] with dicts -> the same with records
+    return [(start_scooter if type(start_scooter) is Observation else dict_2_observation(start_scooter),
+             dicts_2_observations(end_scooters)) for start_scooter, end_scooters in trip_candidates]
+
+def observation_2_dict(scooter) -> dict:
+    # for json: a record is written as dict (without the unknown lastLocationUpdate), dicts stay as they are
+    if type(scooter) is not Observation:
+        return scooter
+    scooter_dict = scooter._asdict()
+    if scooter_dict['lastLocationUpdate'] is None:
+        del scooter_dict['lastLocationUpdate']
+    return scooter_dict
+
+def columnar_2_observations(recordings_lst: [(int, np.ndarray)], id_lst: [str]) -> [(int, [Observation])]:
+    # the same as sanitize_data(columnar_2_dicts(...)), but without building the dicts in between
+    output_lst = []
+    for date_utc, snapshot in recordings_lst:
+        scooters_dict = {}  # by id, like the dicts of load_all_files() (a repeated ID keeps its first position)
+        for row in snapshot.tolist():
+            (id_index, lat, lng, battery, range_meters, llu_utc, lsc_utc, llu_timestamp, lsc_timestamp, cts) = row
+            id = id_lst[id_index]
+            scooters_dict[id] = Observation(id, lat, lng, battery, cts, llu_timestamp, lsc_timestamp,
+                                            utc_2_time_string(llu_utc))
+        output_lst.append((date_utc, list(scooters_dict.values())))
+    return output_lst
+
+# binary cache of a collection folder (written by load_all_files_cached()):
+#   observations.npy: all snapshots of the folder in one structured array (SCOOTER_DTYPE), sorted by time
+#   snapshot_times.npy, snapshot_offsets.npy: collection timestamp and first row of every snapshot (+ end)
+#   ids.json: the scooter-IDs (id_index -> ID)
+#   manifest.json: format version and the fingerprint (name, size, mtime) of the files, written last
+CACHE_FORMAT_VERSION = 1
+
+def __folder_fingerprint(filename_lst: [str]) -> [[str, int, int]]:
+    fingerprint = []
+    for filename in filename_lst:
+        stat = os.stat(filename)
+        fingerprint.append([os.path.basename(filename), stat.st_size, stat.st_mtime_ns])
+    return sorted(fingerprint)
+
+def __read_snapshot_cache(cache_folder: str, fingerprint: [[str, int, int]]) -> ([(int, np.ndarray)], [str]):
+    # returns None if there is no valid cache for this fingerprint
+    try:
+        with open(os.path.join(cache_folder, "manifest.json")) as manifest_file:
+            manifest = json.load(manifest_file)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('format_version') != CACHE_FORMAT_VERSION or manifest.get('files') != fingerprint:
+        return None
+    observations = np.load(os.path.join(cache_folder, "observations.npy"), mmap_mode='r')
+    snapshot_times = np.load(os.path.join(cache_folder, "snapshot_times.npy"))
+    snapshot_offsets = np.load(os.path.join(cache_folder, "snapshot_offsets.npy"))
+    with open(os.path.join(cache_folder, "ids.json")) as ids_file:
+        id_lst = json.load(ids_file)
+    recordings_lst = []
+    for i in range(len(snapshot_times)):
+        recordings_lst.append((int(snapshot_times[i]), observations[snapshot_offsets[i]:snapshot_offsets[i+1]]))
+    return recordings_lst, id_lst
+
+def __write_snapshot_cache(cache_folder: str, fingerprint: [[str, int, int]], recordings_lst: [(int, np.ndarray)], id_lst: [str]):
+    os.makedirs(cache_folder, exist_ok=True)
+    manifest_filename = os.path.join(cache_folder, "manifest.json")
+    if os.path.isfile(manifest_filename):
+        os.remove(manifest_filename)  # the cache is invalid until the new manifest is written
+    snapshot_times = np.array([date_utc for date_utc, _ in recordings_lst], dtype=np.int64)
+    snapshot_offsets = np.zeros(len(recordings_lst) + 1, dtype=np.int64)
+    snapshot_offsets[1:] = np.cumsum([len(snapshot) for _, snapshot in recordings_lst])
+    if len(recordings_lst) > 0:
+        observations = np.concatenate([snapshot for _, snapshot in recordings_lst])
+    else:
+        observations = np.zeros(0, dtype=SCOOTER_DTYPE)
+    np.save(os.path.join(cache_folder, "observations.npy"), observations)
+    np.save(os.path.join(cache_folder, "snapshot_times.npy"), snapshot_times)
+    np.save(os.path.join(cache_folder, "snapshot_offsets.npy"), snapshot_offsets)
+    with open(os.path.join(cache_folder, "ids.json"), 'w') as ids_file:
+        json.dump(id_lst, ids_file)
+    with open(manifest_filename, 'w') as manifest_file:
+        json.dump({'format_version': CACHE_FORMAT_VERSION, 'files': fingerprint}, manifest_file)
+
+def load_all_files_cached(folder: str, cache_folder: str = None, workers: int = 1, verbose: bool = False) -> ([(int, np.ndarray)], [str]):
+    # like load_all_files_columnar(), but the result is stored in a binary cache (default: folder/.snapshot_cache).
+    # when the files of the folder did not change (names, sizes, mtimes), the cache is memory-mapped instead of parsing
+    # the json-files again. the snapshots are read-only views into the memory-mapped file.
+    if cache_folder is None:
+        cache_folder = os.path.join(folder, ".snapshot_cache")
+    fingerprint = __folder_fingerprint(__list_vehicle_files(folder))
+    cached = __read_snapshot_cache(cache_folder, fingerprint)
+    if cached is not None:
+        if verbose:
+            print(f"load_all_files_cached: loaded {folder} from cache {cache_folder}")
+        return cached
+    recordings_lst, id_lst = load_all_files_columnar(folder, workers=workers)
+    try:
+        __write_snapshot_cache(cache_folder, fingerprint, recordings_lst, id_lst)
+        if verbose:
+            print(f"load_all_files_cached: wrote cache {cache_folder}")
+    except OSError as error:
+        print(f"load_all_files_cached: could not write the cache {cache_folder}: {error}")
+    return recordings_lst, id_lst
 
 
 if __name__ == '__main__':
@@ -1,6 +1,9 @@
+import dataloader
 import utilities
+from dataloader import Observation
 
-def print_trip_candidates_statistics(trip_candidates: [(dict, [dict])]):
+def print_trip_candidates_statistics(trip_candidates: [(Observation, [Observation])]):
+    trip_candidates = dataloader.candidates_2_observations(trip_candidates)
     single_lst_correct = 0
     single_lst_wrong = 0
     multi_2lst_correct = 0
@@ -12,9 +15,9 @@ def print_trip_candidates_statistics(trip_candidates: [(dict, [dict])]):
     for start_scooter, end_scooters_lst in trip_candidates:
         list_len = len(end_scooters_lst)
         found_correct = False
-        start_id = start_scooter['id']
+        start_id = start_scooter.id
         for end_candidate in end_scooters_lst:
-            end_cand_id = end_candidate['id']
+            end_cand_id = end_candidate.id
             if start_id == end_cand_id:
                 found_correct = True
                 break
@@ -44,87 +47,119 @@ def print_trip_candidates_statistics(trip_candidates: [(dict, [dict])]):
           f"(2={multi_2lst_correct}, 3={multi_3lst_correct}, n={multi_nlst_correct}), "
           f"multi_candidates_wrong: {multi_2lst_wrong+multi_3lst_wrong+multi_nlst_wrong} ({(multi_2lst_wrong+multi_3lst_wrong+multi_nlst_wrong)/len(trip_candidates)*100:2.3f}%), "
           f"(2={multi_2lst_wrong}, 3={multi_3lst_wrong}, n={multi_nlst_wrong})")
+    return {'candidates': len(trip_candidates),
+            'single_candidate_correct': single_lst_correct, 'single_candidate_wrong': single_lst_wrong,
+            'multi_2_correct': multi_2lst_correct, 'multi_3_correct': multi_3lst_correct, 'multi_n_correct': multi_nlst_correct,
+            'multi_2_wrong': multi_2lst_wrong, 'multi_3_wrong': multi_3lst_wrong, 'multi_n_wrong': multi_nlst_wrong}
 
-def print_trip_distances(trip_identified: [(dict, [dict])], dist: float = 0.5):
+def print_trip_distances(trip_identified: [(Observation, [Observation])], dist: float = 0.5):
+    trip_identified = dataloader.candidates_2_observations(trip_identified)
     dist_less_n = 0
     dist_larger_n = 0
     for start_scooter, end_scooters_lst in trip_identified:
-        start_lat = start_scooter["lat"]
-        start_lng = start_scooter["lng"]
-        end_lat = end_scooters_lst[0]["lat"]
-        end_lng = end_scooters_lst[0]["lng"]
+        start_lat = start_scooter.lat
+        start_lng = start_scooter.lng
+        end_lat = end_scooters_lst[0].lat
+        end_lng = end_scooters_lst[0].lng
         beeline_dist = utilities.geodetic_locations_2_dist(start_lat, start_lng, end_lat, end_lng)  # [km]
         if beeline_dist < dist:
             dist_less_n += 1
         else:
             dist_larger_n += 1
     print(f"trips shorter/longer than {dist} km: {dist_less_n}/{dist_larger_n}")
+    return {'dist': dist, 'shorter': dist_less_n, 'longer': dist_larger_n}
 
-def print_validation_estimatedOneEnd_vs_real_by_IDs(estimated_trips: [(dict, [dict])], real_trips: [dict]):
+def make_ground_truth_index(real_trips: [dict]) -> dict:
+    # index of the ground-truth events by (id, start collection_timestamp_utc), built once and passed to the
+    # print_validation_* functions (e.g. when they are called with several thresholds).
+    # returns {'ground_truth': number_of_events, 'by_start': {(id, start_time): [events in list order]}}
+    by_start = {}
+    for real_tmp in real_trips:
+        key = (real_tmp['id'], real_tmp['dataset_old']["collection_timestamp_utc"])
+        if key in by_start:
+            by_start[key].append(real_tmp)
+        else:
+            by_start[key] = [real_tmp]
+    return {'ground_truth': len(real_trips), 'by_start': by_start}
+
+def __validation_metrics(estimated_events: int, ground_truth: int, correct_start: int, correct_end: int) -> dict:
+    # precision: share of the estimated events with a correct end, recall: share of the ground-truth events found
+    return {'estimated_events': estimated_events, 'ground_truth': ground_truth,
+            'correct_start': correct_start, 'correct_end': correct_end,
+            'precision': correct_end / estimated_events if estimated_events > 0 else None,
+            'recall': correct_end / ground_truth if ground_truth > 0 else None}
+
+def print_validation_estimatedOneEnd_vs_real_by_IDs(estimated_trips: [(Observation, [Observation])], real_trips: [dict], ground_truth_index: dict = None):
+    estimated_trips = dataloader.candidates_2_observations(estimated_trips)
+    if ground_truth_index is None:
+        ground_truth_index = make_ground_truth_index(real_trips)
+    by_start = ground_truth_index['by_start']
     correct_start_counter = 0
     correct_end_counter = 0
     for start_scooter, end_scooters_lst in estimated_trips:
-        start_time = start_scooter["collection_timestamp_utc"]
-        start_id = start_scooter["id"]
-        end_time = end_scooters_lst[0]["collection_timestamp_utc"]
-        end_id = end_scooters_lst[0]["id"]
-        for real_tmp in real_trips:
-            real_id = real_tmp['id']
-            real_start_time = real_tmp['dataset_old']["collection_timestamp_utc"]
-            real_end_time = real_tmp['dataset_new']["collection_timestamp_utc"]
-            if real_id == start_id == end_id:
-                if start_time == real_start_time:
-                    correct_start_counter += 1
-                    if end_time == real_end_time:
-                        correct_end_counter += 1
-                    break
-    print(f"estimated_events:{len(estimated_trips)}, ground_truth:{len(real_trips)}, correct_end:{correct_end_counter}")
+        start_time = start_scooter.collection_timestamp_utc
+        start_id = start_scooter.id
+        end_time = end_scooters_lst[0].collection_timestamp_utc
+        end_id = end_scooters_lst[0].id
+        real_lst = by_start.get((start_id, start_time))
+        if start_id == end_id and real_lst is not None:
+            correct_start_counter += 1
+            if end_time == real_lst[0]['dataset_new']["collection_timestamp_utc"]:  # the first matching event counts
+                correct_end_counter += 1
+    ground_truth = ground_truth_index['ground_truth']
+    print(f"estimated_events:{len(estimated_trips)}, ground_truth:{ground_truth}, correct_end:{correct_end_counter}")
+    return __validation_metrics(len(estimated_trips), ground_truth, correct_start_counter, correct_end_counter)
 
-def print_validation_estimatedOneEnd_vs_real_by_distance(estimated_trips: [(dict, [dict])], real_trips: [dict], accept_dist_threshold: float = 0.05):
+def print_validation_estimatedOneEnd_vs_real_by_distance(estimated_trips: [(Observation, [Observation])], real_trips: [dict], accept_dist_threshold: float = 0.05, ground_truth_index: dict = None):
+    estimated_trips = dataloader.candidates_2_observations(estimated_trips)
+    if ground_truth_index is None:
+        ground_truth_index = make_ground_truth_index(real_trips)
+    by_start = ground_truth_index['by_start']
     correct_start_counter = 0
     correct_end_counter = 0
     for start_scooter, end_scooters_lst in estimated_trips:
-        start_time = start_scooter["collection_timestamp_utc"]
-        start_id = start_scooter["id"]
-        end_lat = end_scooters_lst[0]['lat']
-        end_lng = end_scooters_lst[0]['lng']
-        for real_tmp in real_trips:
-            real_id = real_tmp['id']
-            real_start_time = real_tmp['dataset_old']["collection_timestamp_utc"]
-            if real_id == start_id and start_time == real_start_time:
-                correct_start_counter += 1
-                real_end_lat = real_tmp['dataset_new']['lat']
-                real_end_lng = real_tmp['dataset_new']['lng']
-                beeline_end_dist = utilities.geodetic_locations_2_dist(end_lat, end_lng, real_end_lat, real_end_lng)  # [km]
-                if beeline_end_dist < accept_dist_threshold:
-                    correct_end_counter += 1
-                    break
-    print(f"estimated_events:{len(estimated_trips)}, ground_truth:{len(real_trips)}, correct_end:{correct_end_counter} (@{accept_dist_threshold*1000}m)")
+        start_time = start_scooter.collection_timestamp_utc
+        start_id = start_scooter.id
+        end_lat = end_scooters_lst[0].lat
+        end_lng = end_scooters_lst[0].lng
+        for real_tmp in by_start.get((start_id, start_time), []):
+            correct_start_counter += 1
+            real_end_lat = real_tmp['dataset_new']['lat']
+            real_end_lng = real_tmp['dataset_new']['lng']
+            beeline_end_dist = utilities.geodetic_locations_2_dist(end_lat, end_lng, real_end_lat, real_end_lng)  # [km]
+            if beeline_end_dist < accept_dist_threshold:
+                correct_end_counter += 1
+                break
+    ground_truth = ground_truth_index['ground_truth']
+    print(f"estimated_events:{len(estimated_trips)}, ground_truth:{ground_truth}, correct_end:{correct_end_counter} (@{accept_dist_threshold*1000}m)")
+    return __validation_metrics(len(estimated_trips), ground_truth, correct_start_counter, correct_end_counter)
 
-def print_validation_estimatedMultiEnd_vs_real_by_distance(estimated_trips: [(dict, [dict])], real_trips: [dict], accept_dist_threshold: float = 0.05):
+def print_validation_estimatedMultiEnd_vs_real_by_distance(estimated_trips: [(Observation, [Observation])], real_trips: [dict], accept_dist_threshold: float = 0.05, ground_truth_index: dict = None):
+    estimated_trips = dataloader.candidates_2_observations(estimated_trips)
+    if ground_truth_index is None:
+        ground_truth_index = make_ground_truth_index(real_trips)
+    by_start = ground_truth_index['by_start']
     correct_start_counter = 0
     correct_end_counter = 0
     for start_scooter, end_scooters_lst in estimated_trips:
-        start_time = start_scooter["collection_timestamp_utc"]
-        start_id = start_scooter["id"]
+        start_time = start_scooter.collection_timestamp_utc
+        start_id = start_scooter.id
         end_found = False
-        for real_tmp in real_trips:
-            real_id = real_tmp['id']
-            real_start_time = real_tmp['dataset_old']["collection_timestamp_utc"]
-            if real_id == start_id and start_time == real_start_time:
-                correct_start_counter += 1
-                real_end_lat = real_tmp['dataset_new']['lat']
-                real_end_lng = real_tmp['dataset_new']['lng']
-                # go through the possible end_list
-                for end_scooter in end_scooters_lst:
-                    end_lat = end_scooter['lat']
-                    end_lng = end_scooter['lng']
-                    beeline_end_dist = utilities.geodetic_locations_2_dist(end_lat, end_lng, real_end_lat, real_end_lng)  # [km]
-                    if beeline_end_dist < accept_dist_threshold:
-                        correct_end_counter += 1
-                        end_found = True
-                        break
+        for real_tmp in by_start.get((start_id, start_time), []):
+            correct_start_counter += 1
+            real_end_lat = real_tmp['dataset_new']['lat']
+            real_end_lng = real_tmp['dataset_new']['lng']
+            # go through the possible end_list
+            for end_scooter in end_scooters_lst:
+                end_lat = end_scooter.lat
+                end_lng = end_scooter.lng
+                beeline_end_dist = utilities.geodetic_locations_2_dist(end_lat, end_lng, real_end_lat, real_end_lng)  # [km]
+                if beeline_end_dist < accept_dist_threshold:
+                    correct_end_counter += 1
+                    end_found = True
+                    break
             if end_found:
                 break
-    print(f"multi_ends:{len(estimated_trips)}, ground_truth:{len(real_trips)}, correct_end:{correct_end_counter}")
-
+    ground_truth = ground_truth_index['ground_truth']
+    print(f"multi_ends:{len(estimated_trips)}, ground_truth:{ground_truth}, correct_end:{correct_end_counter}")
+    return __validation_metrics(len(estimated_trips), ground_truth, correct_start_counter, correct_end_counter)
@@ -1,9 +1,24 @@
+import argparse
+import contextlib
 import geopy.distance
+import glob
+import itertools
 import json
+import os
+import re
+import sys
+import time
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
 import dataloader
+from dataloader import Observation
 import trip_extractor_full_data
 import evaluation
+import geo_tools
+import pathfinder
+import telemetry
 import utilities
 
 
@@ -14,219 +29,430 @@ def __geodetic_locations_2_dist(coord1_lat: float, coord1_long: float, coord2_la
     distance = geopy.distance.geodesic(coords_1, coords_2).km
     return distance
 
-def sanitize_data(loaded_data_with_id: [(int, dict)]) -> [(int, [dict])]:
+def sanitize_data(loaded_data_with_id: [(int, dict)]) -> [(int, [Observation])]:
     # convert from a list of (timestamps, dict[scooter_ID, scooter_data]) to a list of (timestamp, [scooter_data])
-    # (where scooter_data is also a dict). For sanity-checking the scooters keep their IDs inside
+    # (where scooter_data is an Observation record). For sanity-checking the scooters keep their IDs inside
     output_lst = []
     for element in loaded_data_with_id:
         timestamp, all_scooters_dict = element
-        all_scooters_lst = list(all_scooters_dict.values())
+        all_scooters_lst = dataloader.dicts_2_observations(list(all_scooters_dict.values()))
         output_lst.append((timestamp, all_scooters_lst))
     return output_lst
 
-def remove_standing_scooters(scooters_t1: [dict], scooters_t2: [dict], verbose: bool = False) -> ([dict], [dict]):
-    # TODO: optimize this to make it faster for larger data-analysis (numpy vectorization for dist-calculation)
+def __pick_best_candidate(candidate_indices: np.ndarray, dists: np.ndarray) -> (int, float):
+    # returns (index, dist) of the candidate with the smallest distance. on a tie the highest index wins, this is the same
+    # result as the backwards scan with 'dist < best_candidate_dist' over all scooters.
+    best_candidate_index = None
+    best_candidate_dist = 999
+    for k in range(len(candidate_indices)-1, -1, -1):
+        if dists[k] < best_candidate_dist:
+            best_candidate_index = int(candidate_indices[k])
+            best_candidate_dist = dists[k]
+    return best_candidate_index, best_candidate_dist
+
+def remove_standing_scooters(scooters_t1: [Observation], scooters_t2: [Observation], verbose: bool = False) -> ([Observation], [Observation]):
     # 1. remove scooters that are just standing around. for each scooter at t1 find the scooter at t2 with minimal distance:
     #   if (min_dist < GPS_inaccuracy) and (battery-level is the same) and (lastLocationUpdate is same) this is the same scooter
     threshold_gps_accuracy = 0.002  # 2m
+    scooters_t1 = dataloader.dicts_2_observations(scooters_t1)
+    scooters_t2 = dataloader.dicts_2_observations(scooters_t2)
+    # the perfect standing scooters are matched by their lastLocationUpdate string, it is only missing in records that
+    # were not made from the raw data (e.g. of a version 1 .npz file)
+    for scooter in itertools.chain(scooters_t1, scooters_t2):
+        if scooter.lastLocationUpdate is None:
+            raise Exception(f"remove_standing_scooters: scooter {scooter.id} has no lastLocationUpdate, use records made from the raw data")
     perfect_standing_deletions = 0
     standing_deletions = 0
-    # first remove all perfect still standing scooters (the majority)
+    available_1 = np.ones(len(scooters_t1), dtype=bool)
+    available_2 = np.ones(len(scooters_t2), dtype=bool)
+    # first remove all perfect still standing scooters (the majority). dist == 0 is the same as equal coordinates, so
+    # this is a hash-join on (lat, lng, lastLocationUpdate, lastStateChange) without any distance calculation
     if verbose:
         print(f"remove standing scooters (perfect):")
-    for i in range(len(scooters_t1)-1, -1, -1):  # go backwards to avoid skipping + out of bounds when removing items
+    positions_2 = {}  # {(lat, lng, llu, lsc): [positions in scooters_t2]}
+    for j, scooter_2 in enumerate(scooters_t2):
+        key = (scooter_2.lat, scooter_2.lng, scooter_2.lastLocationUpdate, scooter_2.lastStateChange_timestamp)
+        positions_2.setdefault(key, []).append(j)
+    for i in range(len(scooters_t1)-1, -1, -1):  # go backwards, like deleting the items from the lists
         if verbose:
             if i%100 == 0:
                 print(f"{i}/{len(scooters_t1)}")
         scooter_1 = scooters_t1[i]
-        lat1 = scooter_1["lat"]
-        lng1 = scooter_1["lng"]
-        llu1 = scooter_1["lastLocationUpdate"]
-        lsc1 = scooter_1['lastStateChange_timestamp']
-        for j in range(len(scooters_t2)-1, -1, -1):
-            scooter_2 = scooters_t2[j]
-            lat2 = scooter_2["lat"]
-            lng2 = scooter_2["lng"]
-            llu2 = scooter_2["lastLocationUpdate"]
-            lsc2 = scooter_2['lastStateChange_timestamp']
-            dist = __geodetic_locations_2_dist(lat1, lng1, lat2, lng2)
-            if dist == 0 and llu1 == llu2 and lsc1 == lsc2:  # you found the scooter obviously
-                if scooters_t1[i]['id'] != scooters_t2[j]['id']:  # sanity-checking
-                    print("Sanity-Warning: remove_standing_scooters() removes perfect scooters with not the same ID!")
-                del scooters_t1[i]
-                del scooters_t2[j]
-                perfect_standing_deletions += 1
-                break
-    # than remove the standing but GPS-error scooters
+        key = (scooter_1.lat, scooter_1.lng, scooter_1.lastLocationUpdate, scooter_1.lastStateChange_timestamp)
+        positions = positions_2.get(key)
+        if not positions:
+            continue
+        j = positions.pop()  # the backwards scan over scooters_t2 takes the last one
+        if scooters_t1[i].id != scooters_t2[j].id:  # sanity-checking
+            print("Sanity-Warning: remove_standing_scooters() removes perfect scooters with not the same ID!")
+        available_1[i] = False
+        available_2[j] = False
+        perfect_standing_deletions += 1
+    # than remove the standing but GPS-error scooters. the blocks (distances, battery- and lastStateChange-masks) of the
+    # remaining scooters are calculated at once with numpy, then they are matched greedy like before.
     if verbose:
         print(f"remove standing scooters (GPS):")
-    for i in range(len(scooters_t1)-1, -1, -1):
+    rest_1 = np.flatnonzero(available_1)
+    rest_2 = np.flatnonzero(available_2)
+    keys = ["lat", "lng", "batteryLevel", "lastStateChange_timestamp"]
+    arr1 = geo_tools.scooters_2_arrays([scooters_t1[i] for i in rest_1], keys)
+    arr2 = geo_tools.scooters_2_arrays([scooters_t2[j] for j in rest_2], keys)
+    dist_approx = geo_tools.haversine_matrix(arr1['lat'], arr1['lng'], arr2['lat'], arr2['lng'])  # [km]
+    candidate_mask = ((arr1['lastStateChange_timestamp'][:, None] == arr2['lastStateChange_timestamp'][None, :]) &
+                      (np.abs(arr1['batteryLevel'][:, None] - arr2['batteryLevel'][None, :]) < 2) &
+                      (dist_approx < geo_tools.prefilter_threshold(threshold_gps_accuracy)))
+    available_rest_2 = np.ones(len(rest_2), dtype=bool)
+    for r in range(len(rest_1)-1, -1, -1):
         if verbose:
-            if i%100 == 0:
-                print(f"{i}/{len(scooters_t1)}")
-        scooter_1 = scooters_t1[i]
-        lat1 = scooter_1["lat"]
-        lng1 = scooter_1["lng"]
-        bat1 = scooter_1["batteryLevel"]
-        lsc1 = scooter_1['lastStateChange_timestamp']
-        best_candidate_index = None
-        best_candidate_dist = 999
-        for j in range(len(scooters_t2)-1, -1, -1):
-            scooter_2 = scooters_t2[j]
-            lat2 = scooter_2["lat"]
-            lng2 = scooter_2["lng"]
-            bat2 = scooter_2["batteryLevel"]
-            lsc2 = scooter_2['lastStateChange_timestamp']
-            dist = __geodetic_locations_2_dist(lat1, lng1, lat2, lng2)
-            if dist < best_candidate_dist and abs(bat1 - bat2) < 2 and lsc1 == lsc2:  # you found a better candidate
-                best_candidate_index = j
-                best_candidate_dist = dist
+            if r%100 == 0:
+                print(f"{r}/{len(rest_1)}")
+        candidates = np.flatnonzero(candidate_mask[r] & available_rest_2)
+        if len(candidates) == 0:
+            continue
+        dists = geo_tools.geodesic_dists(candidates, arr1['lat'][r], arr1['lng'][r], arr2['lat'], arr2['lng'])
+        best_candidate, best_candidate_dist = __pick_best_candidate(candidates, dists)
         if best_candidate_dist < threshold_gps_accuracy:  # you found a scooter that did not move
-            if scooters_t1[i]['id'] != scooters_t2[best_candidate_index]['id']:  # sanity-checking
+            i = rest_1[r]
+            best_candidate_index = rest_2[best_candidate]
+            if scooters_t1[i].id != scooters_t2[best_candidate_index].id:  # sanity-checking
                 print("Sanity-Warning: remove_standing_scooters() removes GPS-moved scooters with not the same ID!")
                 print(f"     scooter_old: {scooters_t1[i]}")
                 print(f"     scooter_new: {scooters_t2[best_candidate_index]}")
-            del scooters_t1[i]
-            del scooters_t2[best_candidate_index]
+            available_1[i] = False
+            available_2[best_candidate_index] = False
+            available_rest_2[best_candidate] = False
             standing_deletions += 1
+    # remove the matched scooters from the lists (in place, as before)
+    scooters_t1[:] = [scooter for scooter, available in zip(scooters_t1, available_1) if available]
+    scooters_t2[:] = [scooter for scooter, available in zip(scooters_t2, available_2) if available]
     if verbose:
         print(f"remove perfect_standing:{perfect_standing_deletions}, standing:{standing_deletions}")
     return scooters_t1, scooters_t2
 
-def remove_slightly_moving_scooters(scooters_t1: [dict], scooters_t2: [dict], verbose: bool = False) -> ([dict], [dict]):
+def remove_slightly_moving_scooters(scooters_t1: [Observation], scooters_t2: [Observation], verbose: bool = False) -> ([Observation], [Observation]):
     # 2. remove scooters that are just moved a few meters in a short period of time (between two collection times t1 and t2)
+    # the t1 x t2 blocks are calculated at once with numpy (the haversine distance as pre-filter), only the few remaining
+    # pairs are checked with the exact geodesic distance.
     threshold_gps_accuracy = 0.002  # 2m
     threshold_movement = 0.5  # 500m
     moved_deletions = 0
-    for i in range(len(scooters_t1) - 1, -1, -1):  # go backwards to avoid skipping + out of bounds when removing items
-        scooter_1 = scooters_t1[i]
-        lat1 = scooter_1["lat"]
-        lng1 = scooter_1["lng"]
-        bat1 = scooter_1["batteryLevel"]
-        lsc1 = scooter_1['lastStateChange_timestamp']
-        cts1 = scooter_1['collection_timestamp_utc']
-        best_candidate_index = None
-        best_candidate_dist = 999
-        for j in range(len(scooters_t2) - 1, -1, -1):
-            scooter_2 = scooters_t2[j]
-            lat2 = scooter_2["lat"]
-            lng2 = scooter_2["lng"]
-            bat2 = scooter_2["batteryLevel"]
-            llu2 = scooter_2["lastLocationUpdate_timestamp"]
-            lsc2 = scooter_2['lastStateChange_timestamp']
-            cts2 = scooter_2['collection_timestamp_utc']
-            dist = __geodetic_locations_2_dist(lat1, lng1, lat2, lng2)
-            if dist < threshold_movement:
-                time_diff = llu2 - cts1
-                if time_diff < 1:
-                    time_diff = cts2 - cts1
-                speed = dist / time_diff * 3600  # [km/h]
-                if dist < best_candidate_dist and bat1 - bat2 < 3 and lsc1 == lsc2 and speed < 17:
-                    best_candidate_index = j
-                    best_candidate_dist = dist
+    scooters_t1 = dataloader.dicts_2_observations(scooters_t1)
+    scooters_t2 = dataloader.dicts_2_observations(scooters_t2)
+    keys = ["lat", "lng", "batteryLevel", "lastLocationUpdate_timestamp", "lastStateChange_timestamp", "collection_timestamp_utc"]
+    arr1 = geo_tools.scooters_2_arrays(scooters_t1, keys)
+    arr2 = geo_tools.scooters_2_arrays(scooters_t2, keys)
+    available_1 = np.ones(len(scooters_t1), dtype=bool)
+    available_2 = np.ones(len(scooters_t2), dtype=bool)
+    cts1 = arr1['collection_timestamp_utc'][:, None]
+    time_diff = arr2['lastLocationUpdate_timestamp'][None, :] - cts1
+    time_diff = np.where(time_diff < 1, arr2['collection_timestamp_utc'][None, :] - cts1, time_diff)
+    dist_approx = geo_tools.haversine_matrix(arr1['lat'], arr1['lng'], arr2['lat'], arr2['lng'])  # [km]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        speed_approx = dist_approx / time_diff * 3600  # [km/h]
+    candidate_mask = ((arr1['lastStateChange_timestamp'][:, None] == arr2['lastStateChange_timestamp'][None, :]) &
+                      (arr1['batteryLevel'][:, None] - arr2['batteryLevel'][None, :] < 3) &
+                      (dist_approx < geo_tools.prefilter_threshold(threshold_movement)) &
+                      (speed_approx < geo_tools.prefilter_threshold(17)))
+    for i in range(len(scooters_t1) - 1, -1, -1):  # go backwards, like deleting the items from the lists
+        candidates = np.flatnonzero(candidate_mask[i] & available_2)
+        if len(candidates) == 0:
+            continue
+        dists = geo_tools.geodesic_dists(candidates, arr1['lat'][i], arr1['lng'][i], arr2['lat'], arr2['lng'])
+        speeds = dists / time_diff[i, candidates] * 3600  # [km/h]
+        valid = (dists < threshold_movement) & (speeds < 17)
+        best_candidate_index, _ = __pick_best_candidate(candidates[valid], dists[valid])
         if best_candidate_index is not None:
-            if scooters_t1[i]['id'] != scooters_t2[best_candidate_index]['id']:  # sanity-checking
+            if scooters_t1[i].id != scooters_t2[best_candidate_index].id:  # sanity-checking
                 print("Sanity-Warning: remove_slightly_moving_scooters() removes scooters with not the same ID!")
-            del scooters_t1[i]
-            del scooters_t2[best_candidate_index]
+            available_1[i] = False
+            available_2[best_candidate_index] = False
             moved_deletions += 1
+    # remove the matched scooters from the lists (in place, as before)
+    scooters_t1[:] = [scooter for scooter, available in zip(scooters_t1, available_1) if available]
+    scooters_t2[:] = [scooter for scooter, available in zip(scooters_t2, available_2) if available]
     if verbose:
         print(f"remove_slightly_moving_scooters deletions:{moved_deletions}")
     return scooters_t1, scooters_t2
 
-def __ground_truth_find_scooters_in_both_sets(scooters_t1: [dict], scooters_t2: [dict]):
+def __ground_truth_find_scooters_in_both_sets(scooters_t1: [Observation], scooters_t2: [Observation]):
     scooters_in_both = []
     for scooter_1 in scooters_t1:
-        id1 = scooter_1['id']
+        id1 = scooter_1.id
         for scooter_2 in scooters_t2:
-            id2 = scooter_2['id']
+            id2 = scooter_2.id
             if id1 == id2:
-                dist = __geodetic_locations_2_dist(scooter_1['lat'], scooter_1['lng'], scooter_2['lat'], scooter_2['lng'],)
-                bat_delta = scooter_1['batteryLevel'] - scooter_2['batteryLevel']
+                dist = __geodetic_locations_2_dist(scooter_1.lat, scooter_1.lng, scooter_2.lat, scooter_2.lng,)
+                bat_delta = scooter_1.batteryLevel - scooter_2.batteryLevel
                 entry = (id1, dist, bat_delta)
                 scooters_in_both.append(entry)
                 break
     if len(scooters_in_both) > 0:
         print(f"ground-truth number of scooters in both sets: {len(scooters_in_both)}: {scooters_in_both}")
 
-def make_appearing_disappearing_lists(collection_lst: [(int, [dict])], verbose: bool = True) -> ([(int, [dict])], [(int, dict)]):
+def __remove_pair_scooters(lst1: [Observation], lst2: [Observation], verbose: bool) -> ([Observation], [Observation], float):
+    # the removals of one snapshot-pair, shared by process_snapshot_pair() and the process pool. returns the remaining
+    # scooters of both snapshots and the duration [sec] (recorded by the caller, in the process of the telemetry)
+    start_time = time.perf_counter()
+    lst1 = dataloader.dicts_2_observations(lst1)[:]  # make a copy of the lists (no deepcopy required, just a new list)
+    lst2 = dataloader.dicts_2_observations(lst2)[:]
+    lst1, lst2 = remove_standing_scooters(lst1, lst2, verbose=False)
+    lst1, lst2 = remove_slightly_moving_scooters(lst1, lst2, verbose=verbose)
+    return lst1, lst2, time.perf_counter() - start_time
+
+def process_snapshot_pair(time1: int, lst1: [Observation], time2: int, lst2: [Observation], verbose: bool = True) -> ((int, [Observation]), (int, [Observation])):
+    # do the collection-to-collection removals of standing scooters for two consecutive snapshots.
+    # returns the disappearing scooters (time1, [...]) and the appearing scooters (time2, [...])
+    lst1, lst2, duration = __remove_pair_scooters(lst1, lst2, verbose)
+    if verbose:
+        print(f"lst1: {len(lst1)}, lst2: {len(lst2)}")
+    telemetry.record_timing("snapshot_pair", duration)
+    __ground_truth_find_scooters_in_both_sets(lst1, lst2)
+    return (time1, lst1), (time2, lst2)
+
+def __process_snapshot_pair_worker(pair: (int, [Observation], int, [Observation])) -> ((int, [Observation]), (int, [Observation]), int, float):
+    # the removals of process_snapshot_pair() for the process pool (without printing). also returns the process-id and
+    # the duration for the progress report and the telemetry of the main process
+    time1, lst1, time2, lst2 = pair
+    lst1, lst2, duration = __remove_pair_scooters(lst1, lst2, verbose=False)
+    return (time1, lst1), (time2, lst2), os.getpid(), duration
+
+def make_appearing_disappearing_lists(collection_lst: [(int, [Observation])], verbose: bool = True, workers: int = 1) -> ([(int, [Observation])], [(int, dict)]):
+    # workers: with workers > 1 the snapshot-pairs are processed in a process pool (each pair is independent). the
+    # results keep the order of the snapshots.
     appear_lst = []
     disappear_lst = []
+    if workers > 1:
+        pairs = ((collection_lst[i][0], collection_lst[i][1], collection_lst[i+1][0], collection_lst[i+1][1]) for i in range(len(collection_lst)-1))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(__process_snapshot_pair_worker, pairs, chunksize=4)
+            for i, (disappeared, appeared, worker_pid, duration) in enumerate(results):
+                if verbose:
+                    print(f"collection {i+1}/{len(collection_lst)} (worker {worker_pid}, {duration:.2f}s): lst1: {len(disappeared[1])}, lst2: {len(appeared[1])}")
+                telemetry.record_timing("snapshot_pair", duration)
+                __ground_truth_find_scooters_in_both_sets(disappeared[1], appeared[1])
+                disappear_lst.append(disappeared)
+                appear_lst.append(appeared)
+        return appear_lst, disappear_lst
     # do some collection-to-collection removals of standing scooters
     for i in range(len(collection_lst)-1):
         if verbose:
             print(f"collection {i+1}/{len(collection_lst)}")
         time1, lst1 = collection_lst[i]
         time2, lst2 = collection_lst[i+1]
-        lst1 = lst1[:]  # make a copy of the lists (no deepcopy required, just a new list)
-        lst2 = lst2[:]
-        lst1, lst2 = remove_standing_scooters(lst1, lst2, verbose=False)
-        lst1, lst2 = remove_slightly_moving_scooters(lst1, lst2, verbose=True)
-        if verbose:
-            print(f"lst1: {len(lst1)}, lst2: {len(lst2)}")
-        __ground_truth_find_scooters_in_both_sets(lst1, lst2)
-        disappear_lst.append((time1, lst1))
-        appear_lst.append((time2, lst2))
+        disappeared, appeared = process_snapshot_pair(time1, lst1, time2, lst2, verbose=verbose)
+        disappear_lst.append(disappeared)
+        appear_lst.append(appeared)
     return appear_lst, disappear_lst
 
-def safe_appearing_disappearing_lists(appear_lst: [(int, [dict])], disappear_lst: [(int, [dict])], filename: str):
-    my_lists = (appear_lst, disappear_lst)
+def stream_appearing_disappearing(collection_iter, verbose: bool = False):
+    # streaming version of make_appearing_disappearing_lists(): consumes the snapshots (timestamp, [scooters]) one at a
+    # time (e.g. directly from the collector) and keeps only the previous snapshot in memory. for every new snapshot
+    # it yields the pair ((time1, disappeared_scooters), (time2, appeared_scooters)), like one entry of both lists.
+    # example: stream_appearing_disappearing((t, list(d.values())) for t, d in dataloader.iter_all_files(folder))
+    previous = None
+    counter = 0
+    for time2, lst2 in collection_iter:
+        if previous is not None:
+            counter += 1
+            if verbose:
+                print(f"collection {counter}")
+            time1, lst1 = previous
+            yield process_snapshot_pair(time1, lst1, time2, lst2, verbose=verbose)
+        previous = (time2, lst2)
+
+# compact format of the appearing/disappearing lists (.npz): only the fields that are used after
+# make_appearing_disappearing_lists(), stored per list as
+#   <list>_snapshot_times, <list>_snapshot_offsets: collection timestamp and first row of every snapshot (+ end)
+#   <list>_chunk_<n>: the observations (LISTS_DTYPE) of LISTS_CHUNK_SNAPSHOTS snapshots, loaded only when needed
+# and the shared arrays format_version and ids (id_index -> ID). version 1 did not store lastLocationUpdate (the records
+# of such files can not be given to remove_standing_scooters()), both versions can be loaded.
+LISTS_FORMAT_VERSION = 2
+LISTS_CHUNK_SNAPSHOTS = 64
+LISTS_UNKNOWN_TIME = np.iinfo(np.int64).min  # lastLocationUpdate_utc of a record without lastLocationUpdate
+LISTS_DTYPE = np.dtype([
+    ('id_index', np.int32),
+    ('lat', np.float64),
+    ('lng', np.float64),
+    ('batteryLevel', np.int16),
+    ('collection_timestamp_utc', np.int64),
+    ('lastLocationUpdate_timestamp', np.float64),
+    ('lastStateChange_timestamp', np.float64),
+    ('lastLocationUpdate_utc', np.int64),  # real utc-timestamp of the lastLocationUpdate string (to re-build it)
+])
+
+def __lists_2_arrays(name: str, snapshot_lst: [(int, [Observation])], id_dict: dict[str, int], id_lst: [str]) -> dict:
+    arrays = {name+"_snapshot_times": np.array([timestamp for timestamp, _ in snapshot_lst], dtype=np.int64)}
+    snapshot_offsets = np.zeros(len(snapshot_lst) + 1, dtype=np.int64)
+    snapshot_offsets[1:] = np.cumsum([len(scooters) for _, scooters in snapshot_lst])
+    arrays[name+"_snapshot_offsets"] = snapshot_offsets
+    for chunk, first in enumerate(range(0, len(snapshot_lst), LISTS_CHUNK_SNAPSHOTS)):
+        rows = []
+        for _, scooters in snapshot_lst[first:first+LISTS_CHUNK_SNAPSHOTS]:
+            for scooter in dataloader.dicts_2_observations(scooters):
+                if scooter.id not in id_dict:
+                    id_dict[scooter.id] = len(id_lst)
+                    id_lst.append(scooter.id)
+                if scooter.lastLocationUpdate is None:
+                    llu_utc = LISTS_UNKNOWN_TIME
+                else:
+                    llu_utc = dataloader.time_string_2_utc(scooter.lastLocationUpdate)
+                rows.append((id_dict[scooter.id], scooter.lat, scooter.lng, scooter.batteryLevel,
+                             scooter.collection_timestamp_utc, scooter.lastLocationUpdate_timestamp,
+                             scooter.lastStateChange_timestamp, llu_utc))
+        arrays[f"{name}_chunk_{chunk}"] = np.array(rows, dtype=LISTS_DTYPE)
+    return arrays
+
+def __arrays_2_lists(npz_file, name: str, id_lst: [str], time_from: float, time_to: float) -> [(int, [Observation])]:
+    # the snapshots with time_from <= timestamp <= time_to, only their chunks are decompressed
+    snapshot_times = npz_file[name+"_snapshot_times"]
+    snapshot_offsets = npz_file[name+"_snapshot_offsets"]
+    snapshot_lst = []
+    chunks = {}
+    for i in range(len(snapshot_times)):
+        if not (time_from <= snapshot_times[i] <= time_to):
+            continue
+        chunk = i // LISTS_CHUNK_SNAPSHOTS
+        if chunk not in chunks:
+            chunks[chunk] = npz_file[f"{name}_chunk_{chunk}"]
+        chunk_offset = snapshot_offsets[chunk * LISTS_CHUNK_SNAPSHOTS]
+        rows = chunks[chunk][snapshot_offsets[i] - chunk_offset:snapshot_offsets[i+1] - chunk_offset]
+        columns = {field: rows[field].tolist() for field in rows.dtype.names}
+        llu_utcs = columns.get('lastLocationUpdate_utc', [LISTS_UNKNOWN_TIME] * len(rows))  # not in version 1
+        scooters = []
+        for k in range(len(rows)):
+            llu = None if llu_utcs[k] == LISTS_UNKNOWN_TIME else dataloader.utc_2_time_string(llu_utcs[k])
+            scooters.append(Observation(id_lst[columns['id_index'][k]], columns['lat'][k], columns['lng'][k],
+                                        columns['batteryLevel'][k], columns['collection_timestamp_utc'][k],
+                                        columns['lastLocationUpdate_timestamp'][k],
+                                        columns['lastStateChange_timestamp'][k], llu))
+        snapshot_lst.append((int(snapshot_times[i]), scooters))
+    return snapshot_lst
+
+def safe_appearing_disappearing_lists(appear_lst: [(int, [Observation])], disappear_lst: [(int, [Observation])], filename: str):
+    # a filename ending with .npz is written in the compact format (only the used fields), else as json
+    if filename.endswith(".npz"):
+        id_dict = {}
+        id_lst = []
+        arrays = {'format_version': np.array(LISTS_FORMAT_VERSION)}
+        arrays.update(__lists_2_arrays("appear", appear_lst, id_dict, id_lst))
+        arrays.update(__lists_2_arrays("disappear", disappear_lst, id_dict, id_lst))
+        arrays['ids'] = np.array(id_lst, dtype=str)
+        with open(filename, 'wb') as file:
+            np.savez_compressed(file, **arrays)
+        return
+    my_lists = ([(timestamp, [dataloader.observation_2_dict(scooter) for scooter in scooters]) for timestamp, scooters in appear_lst],
+                [(timestamp, [dataloader.observation_2_dict(scooter) for scooter in scooters]) for timestamp, scooters in disappear_lst])
     with open(filename, 'w') as file:
         json.dump(my_lists, file)
 
-def load_appearing_disappearing_lists(filename: str) -> ([(int, [dict])], [(int, [dict])]):
-    file = open(filename)
-    my_lists = json.load(file)
-    return my_lists
+def load_appearing_disappearing_lists(filename: str, time_from: float = float('-inf'), time_to: float = float('inf')) -> ([(int, [Observation])], [(int, [Observation])]):
+    # loads the lists from the json or .npz file, only the snapshots with time_from <= timestamp <= time_to.
+    # from the .npz file only the required parts are loaded. the scooters are returned as Observation records.
+    if filename.endswith(".npz"):
+        with np.load(filename, allow_pickle=False) as npz_file:
+            format_version = int(npz_file['format_version'])
+            if format_version not in (1, LISTS_FORMAT_VERSION):
+                raise Exception(f"load_appearing_disappearing_lists: {filename} has format version {format_version}, expected {LISTS_FORMAT_VERSION}")
+            id_lst = npz_file['ids'].tolist()
+            appear_lst = __arrays_2_lists(npz_file, "appear", id_lst, time_from, time_to)
+            disappear_lst = __arrays_2_lists(npz_file, "disappear", id_lst, time_from, time_to)
+        return appear_lst, disappear_lst
+    with open(filename) as file:
+        appear_lst, disappear_lst = json.load(file)
+    if time_from != float('-inf') or time_to != float('inf'):
+        appear_lst = [(timestamp, scooters) for timestamp, scooters in appear_lst if time_from <= timestamp <= time_to]
+        disappear_lst = [(timestamp, scooters) for timestamp, scooters in disappear_lst if time_from <= timestamp <= time_to]
+    return dataloader.snapshots_2_observations(appear_lst), dataloader.snapshots_2_observations(disappear_lst)
 
-def remove_loading_scooters(appear_lst: [(int, [dict])], disappear_lst: [(int, [dict])], verbose: bool = False) -> ([(int, [dict])], [(int, [dict])]):
+def remove_loading_scooters(appear_lst: [(int, [Observation])], disappear_lst: [(int, [Observation])], verbose: bool = False) -> ([(int, [Observation])], [(int, [Observation])]):
     # if a scooter appears after any time with 100% battery, it was loaded
     # info: when a loading happened, there is always a state-change in the last 3 minutes! so there is never the same lsc-timestamp.
     loading_deletions = 0
     GPS_inaccuracy = 0.001  # 1m
+    appear_lst = dataloader.snapshots_2_observations(appear_lst)
+    disappear_lst = dataloader.snapshots_2_observations(disappear_lst)
+    # index the disappeared scooters with a low battery (only those can be loaded) in a spatial hash with 1m cells, so a
+    # loaded scooter is only compared with the few scooters at the same location
+    old_entries = []  # [(position in disappear_lst, position in the snapshot)]
+    for position_old, (timestamp_old, scooters_lst_old) in enumerate(disappear_lst):
+        for j, scooter_old in enumerate(scooters_lst_old):
+            if scooter_old.batteryLevel <= 40:  # those have too much energy for being loaded (some were loaded with 39%)
+                old_entries.append((position_old, j))
+    old_lats = np.array([disappear_lst[position_old][1][j].lat for position_old, j in old_entries], dtype=float)
+    old_lngs = np.array([disappear_lst[position_old][1][j].lng for position_old, j in old_entries], dtype=float)
+    grid_index = geo_tools.make_grid_index(old_lats, old_lngs, cell_size=GPS_inaccuracy)
+    old_deleted = [False] * len(old_entries)
     for timestamp_new, scooters_lst_new in appear_lst:
+        new_deleted = set()
         for i in range(len(scooters_lst_new)-1, -1, -1):
             scooter_new = scooters_lst_new[i]
-            if scooter_new['batteryLevel'] < 98:  # consider only fresh, fully loaded scooters. not interesting for now
+            if scooter_new.batteryLevel < 98:  # consider only fresh, fully loaded scooters. not interesting for now
                 continue
             # if a scooter was loaded, figure out when the last state-change happened
-            cts_new = scooter_new['collection_timestamp_utc']
-            lsc_new = scooter_new['lastStateChange_timestamp']
+            cts_new = scooter_new.collection_timestamp_utc
+            lsc_new = scooter_new.lastStateChange_timestamp
             # find if there is a disappearing scooter in the past, that has exactly the same location but a much lower battery (and maybe the same lsc?)
-            lat_new = scooter_new["lat"]
-            lng_new = scooter_new["lng"]
-            llu_new = scooter_new["lastLocationUpdate_timestamp"]
-            for timestamp_old, scooters_lst_old in disappear_lst:
-                if timestamp_old >= timestamp_new:  # disappearing scooters from the future are not interesting. stop here
-                    break
-                did_delete = False
-                for j in range(len(scooters_lst_old)-1, -1, -1):
-                    scooter_old = scooters_lst_old[j]
-                    if scooter_old['batteryLevel'] > 40:  # those have too much energy for being loaded (some were loaded with 39%)
-                        continue
-                    lat_old = scooter_old["lat"]
-                    lng_old = scooter_old["lng"]
-                    llu_old = scooter_old["lastLocationUpdate_timestamp"]
-                    lsc_old = scooter_old['lastStateChange_timestamp']
-                    cts_old = scooter_old['collection_timestamp_utc']
-                    dist = __geodetic_locations_2_dist(lat_new, lng_new, lat_old, lng_old)  # [km]
-                    if dist < GPS_inaccuracy:  # this is the same scooter
-                        # the properties cts_new-lsc_new < 4*60 and cts_old < lsc_new hold always, so they are not useful for distinguishing
-                        if scooters_lst_new[i]['id'] != scooters_lst_old[j]['id']:  # sanity-checking
-                            print(f"Sanity-Warning: remove_loading_scooters() removes scooters with not the same ID!")
-                            print(f"                lsc_old: {lsc_old}, llu_old: {llu_old}, cts_old: {cts_old}, llu_new: {llu_new}, lsc_new: {lsc_new}, cts_new: {cts_new}")
-                        del scooters_lst_new[i]
-                        del scooters_lst_old[j]
-                        loading_deletions += 1
-                        did_delete = True
-                        break
-                if did_delete:
-                    break
+            lat_new = scooter_new.lat
+            lng_new = scooter_new.lng
+            llu_new = scooter_new.lastLocationUpdate_timestamp
+            # the match is the scooter from the first disappear-snapshot (in list order) and in there the last one
+            best_entry = None
+            for k in geo_tools.query_grid_index(grid_index, lat_new, lng_new, GPS_inaccuracy):
+                if old_deleted[k]:
+                    continue
+                position_old, j = old_entries[k]
+                if disappear_lst[position_old][0] >= timestamp_new:  # disappearing scooters from the future (or now) are not interesting
+                    continue
+                if best_entry is not None and (position_old, -j) >= (old_entries[best_entry][0], -old_entries[best_entry][1]):
+                    continue
+                scooter_old = disappear_lst[position_old][1][j]
+                dist = __geodetic_locations_2_dist(lat_new, lng_new, scooter_old.lat, scooter_old.lng)  # [km]
+                if dist < GPS_inaccuracy:  # this is the same scooter
+                    best_entry = k
+            if best_entry is None:
+                continue
+            position_old, j = old_entries[best_entry]
+            scooter_old = disappear_lst[position_old][1][j]
+            # the properties cts_new-lsc_new < 4*60 and cts_old < lsc_new hold always, so they are not useful for distinguishing
+            if scooter_new.id != scooter_old.id:  # sanity-checking
+                llu_old = scooter_old.lastLocationUpdate_timestamp
+                lsc_old = scooter_old.lastStateChange_timestamp
+                cts_old = scooter_old.collection_timestamp_utc
+                print(f"Sanity-Warning: remove_loading_scooters() removes scooters with not the same ID!")
+                print(f"                lsc_old: {lsc_old}, llu_old: {llu_old}, cts_old: {cts_old}, llu_new: {llu_new}, lsc_new: {lsc_new}, cts_new: {cts_new}")
+            new_deleted.add(i)
+            old_deleted[best_entry] = True
+            loading_deletions += 1
+        if len(new_deleted) > 0:
+            scooters_lst_new[:] = [scooter for i, scooter in enumerate(scooters_lst_new) if i not in new_deleted]
+    # remove the loaded scooters from the disappear-snapshots (in place, like the appear-snapshots)
+    deleted_by_position = {}
+    for k, (position_old, j) in enumerate(old_entries):
+        if old_deleted[k]:
+            deleted_by_position.setdefault(position_old, set()).add(j)
+    for position_old, deleted in deleted_by_position.items():
+        scooters_lst_old = disappear_lst[position_old][1]
+        scooters_lst_old[:] = [scooter for j, scooter in enumerate(scooters_lst_old) if j not in deleted]
     if verbose:
         print(f"remove_loading_scooters:{loading_deletions}")
     return appear_lst, disappear_lst
 
-def find_scooter_trip_candidates(appear_lst: [(int, [dict])], disappear_lst: [(int, [dict])], verbose: bool = False) -> [(dict, [dict])]:
+def __is_surely_no_trip(dist_approx: float, duration: float, bat_start: int, bat_end: int, lsc_changed_recently: bool) -> bool:
+    # True if the velocity- or battery-checks of find_scooter_trip_candidates() fail for every geodesic distance that is
+    # possible for this haversine distance. then the pair can be rejected without calculating the geodesic distance.
+    dist_low, dist_high = geo_tools.dist_bounds(dist_approx)  # [km]
+    if dist_low / duration * 3600 > 17:  # too fast
+        return True
+    bat_change_real = bat_start - bat_end  # [%]
+    if bat_change_real > round(dist_high * 2) + 3:  # roundtrip
+        return True
+    if bat_change_real < round(dist_low * 2) - 3:  # too less battery usage, if it was not loaded
+        bat_lvl_full = 100 - round(dist_high * 2) - 3
+        if not (bat_end > bat_lvl_full and lsc_changed_recently):
+            return True
+    return False
+
+def find_scooter_trip_candidates(appear_lst: [(int, [Observation])], disappear_lst: [(int, [Observation])], verbose: bool = False) -> [(Observation, [Observation])]:
     # returns a list of pairs: start_scooters (from disappear_lst) and list of possible end_scooters (from apprear_lst)
     trip_candidates = []
     velocity_errors = 0
@@ -236,40 +462,70 @@ def find_scooter_trip_candidates(appear_lst: [(int, [dict])], disappear_lst: [(i
     wrong_candidates = 0
     missing_correct_candidate = 0
     uniquely_identified = 0
+    appear_lst = dataloader.snapshots_2_observations(appear_lst)
+    disappear_lst = dataloader.snapshots_2_observations(disappear_lst)
     last_timestamp, _ = appear_lst[-1]
+    # build a spatial index for every appear-snapshot. with max. 17 km/h only the end scooters within the radius of
+    # 17 km/h * duration are reachable, all others would fail the velocity check anyway.
+    end_indices = []
+    for timestamp_end, scooters_lst_end in appear_lst:
+        end_arrays = geo_tools.scooters_2_arrays(scooters_lst_end, ["lat", "lng", "collection_timestamp_utc"])
+        grid_index = geo_tools.make_grid_index(end_arrays['lat'], end_arrays['lng'])
+        if len(scooters_lst_end) > 0:
+            max_cts_end = int(end_arrays['collection_timestamp_utc'].max())
+        else:
+            max_cts_end = timestamp_end
+        end_positions_by_id = {}  # only for the statistics (ground-truth)
+        for k, end_scooter in enumerate(scooters_lst_end):
+            end_positions_by_id.setdefault(end_scooter.id, []).append(k)
+        end_indices.append((grid_index, max_cts_end, end_positions_by_id))
+    appear_time_index = utilities.make_time_index(appear_lst)
     # do a fist estimation which scooters could be roughly interesting
     for timestamp_start, scooters_lst_start in disappear_lst:
+        # trips can not end in the past or now (they have to end in the future) and the maximal duration of a trip is 2h
+        end_positions = utilities.get_time_window(appear_time_index, timestamp_start, timestamp_start + 2*3600)
         for start_scooter in scooters_lst_start:
             this_candidates_lst = []
-            lat_start = start_scooter["lat"]
-            lng_start = start_scooter["lng"]
-            bat_start = start_scooter['batteryLevel']
-            cts_start = start_scooter['collection_timestamp_utc']
-            lsc_start = start_scooter['lastStateChange_timestamp']
-            for timestamp_end, scooters_lst_end in appear_lst:
-                if timestamp_start >= timestamp_end:  # trips can not end in the past or now (they have to end in the future)
-                    continue
-                if timestamp_start + 2*3600 < timestamp_end:  # the maximal duration of a trip is 2h
-                    continue
-                for end_scooter in scooters_lst_end:
-                    lat_end = end_scooter["lat"]
-                    lng_end = end_scooter["lng"]
-                    bat_end = end_scooter['batteryLevel']
-                    cts_end = end_scooter['collection_timestamp_utc']
-                    lsc_end = end_scooter['lastStateChange_timestamp']
-                    llu_end = end_scooter["lastLocationUpdate_timestamp"]
-                    beeline_dist = __geodetic_locations_2_dist(lat_start, lng_start, lat_end, lng_end)  # [km]
-                    bat_change_real = bat_start - bat_end  # [%]
-                    bat_change_expected = round(beeline_dist * 2)  # all 500m the battery drops about 1%
+            lat_start = start_scooter.lat
+            lng_start = start_scooter.lng
+            bat_start = start_scooter.batteryLevel
+            cts_start = start_scooter.collection_timestamp_utc
+            lsc_start = start_scooter.lastStateChange_timestamp
+            for end_position in end_positions:
+                timestamp_end, scooters_lst_end = appear_lst[end_position]
+                grid_index, max_cts_end, end_positions_by_id = end_indices[end_position]
+                max_radius = 17 * (max_cts_end - cts_start) / 3600  # [km]
+                reachable_positions = geo_tools.query_grid_index(grid_index, lat_start, lng_start, max_radius)
+                for k in end_positions_by_id.get(start_scooter.id, []):
+                    if k not in reachable_positions:  # the correct scooter is out of reach, count it like before
+                        velocity_errors += 1
+                for k in reachable_positions:
+                    end_scooter = scooters_lst_end[k]
+                    lat_end = end_scooter.lat
+                    lng_end = end_scooter.lng
+                    bat_end = end_scooter.batteryLevel
+                    cts_end = end_scooter.collection_timestamp_utc
+                    lsc_end = end_scooter.lastStateChange_timestamp
+                    llu_end = end_scooter.lastLocationUpdate_timestamp
                     t1 = llu_end - cts_start
                     t2 = cts_end - cts_start
                     if t1 < 1:
                         duration = t2  # [sec]
                     else:
                         duration = min(t1, t2)  # [sec]
+                    # cheap rejection with the haversine distance before the exact geodesic distance. the correct
+                    # scooter is always checked exactly, so the error statistics stay the same.
+                    if start_scooter.id != end_scooter.id:
+                        dist_approx = geo_tools.haversine_dist(lat_start, lng_start, lat_end, lng_end)  # [km]
+                        lsc_changed_recently = cts_start < lsc_end < cts_end
+                        if __is_surely_no_trip(dist_approx, duration, bat_start, bat_end, lsc_changed_recently):
+                            continue
+                    beeline_dist = __geodetic_locations_2_dist(lat_start, lng_start, lat_end, lng_end)  # [km]
+                    bat_change_real = bat_start - bat_end  # [%]
+                    bat_change_expected = round(beeline_dist * 2)  # all 500m the battery drops about 1%
                     velocity = beeline_dist / duration * 3600  # [km/h]
                     if velocity > 17:
-                        if start_scooter['id'] == end_scooter['id']:
+                        if start_scooter.id == end_scooter.id:
                             velocity_errors += 1
                         continue
                     if bat_change_real < bat_change_expected - 3:  # if real bat-usage is much smaller than expected (-buffer) - this can not be
@@ -278,11 +534,11 @@ def find_scooter_trip_candidates(appear_lst: [(int, [dict])], disappear_lst: [(i
                         if bat_end > bat_lvl_full and lsc_changed_recently:  # if the battery was loaded directly before or after the trip was done, this is acceptable
                             pass
                         else:
-                            if start_scooter['id'] == end_scooter['id']:
+                            if start_scooter.id == end_scooter.id:
                                 battery_errors += 1
                             continue
                     if bat_change_real > bat_change_expected + 3:  # if the bat-usage is much larger than expected (+buffer) - this is a roundtrip
-                        if start_scooter['id'] == end_scooter['id']:
+                        if start_scooter.id == end_scooter.id:
                             battery_roundtrip += 1
                         continue
                     if lsc_start != lsc_end:
@@ -304,17 +560,17 @@ def find_scooter_trip_candidates(appear_lst: [(int, [dict])], disappear_lst: [(i
                             found_another_explanation = True
                         # check if another explanation was found
                         if not found_another_explanation:
-                            if start_scooter['id'] == end_scooter['id']:
+                            if start_scooter.id == end_scooter.id:
                                 lsc_errors += 1
                             continue
                     # consider it a possible candidate for a trip
-                    if start_scooter['id'] != end_scooter['id']:
+                    if start_scooter.id != end_scooter.id:
                         wrong_candidates += 1
                     this_candidates_lst.append(end_scooter)
             if len(this_candidates_lst) > 0:
                 found_correct = False
                 for cand in this_candidates_lst:
-                    if cand['id'] == start_scooter['id']:
+                    if cand.id == start_scooter.id:
                         found_correct = True
                         if len(this_candidates_lst) == 1:
                             uniquely_identified += 1
@@ -324,60 +580,334 @@ def find_scooter_trip_candidates(appear_lst: [(int, [dict])], disappear_lst: [(i
                 trip_candidates.append((start_scooter, this_candidates_lst))
     if verbose:
         print(f"velocity_errors: {velocity_errors}, battery_errors:{battery_errors}, battery_roundtrip: {battery_roundtrip}, lsc_errors:{lsc_errors}, wrong_candidates: {wrong_candidates}, missing_correct_candidate: {missing_correct_candidate}, uniquely_identified: {uniquely_identified}")
+    if telemetry.is_enabled():
+        telemetry.record_counters("find_scooter_trip_candidates", {
+            'velocity_errors': velocity_errors, 'battery_errors': battery_errors, 'battery_roundtrip': battery_roundtrip,
+            'lsc_errors': lsc_errors, 'wrong_candidates': wrong_candidates,
+            'missing_correct_candidate': missing_correct_candidate, 'uniquely_identified': uniquely_identified})
+        # the size of the end-candidate list of every disappeared scooter (0: no candidate)
+        start_scooters = sum([len(scooters_lst_start) for _, scooters_lst_start in disappear_lst])
+        telemetry.record_histogram("candidate_list_size", [0] * (start_scooters - len(trip_candidates)) +
+                                   [len(end_lst) for _, end_lst in trip_candidates])
     return trip_candidates
 
-if __name__ == '__main__':
+# the seven evaluation days of the paper (Table 8)
+PAPER_DATES = ["2023_10_01", "2023_10_24", "2023_11_15", "2023_12_18", "2024_01_04", "2024_03_09", "2024_03_16"]
+
+def run_day(used_date: str, data_folder: str = "data", recompute: bool = False, workers: int = 1,
+            by_components: bool = False) -> dict:
+    # runs the full pipeline for one day and returns a summary of the results.
+    # with by_components, the steps 3-6 resolve every connected component of the trip candidates on its own (with
+    # workers processes). this can differ slightly from the global resolution, which visits the candidates in list order.
+    summary, _ = __run_day(used_date, data_folder, recompute, workers, by_components)
+    return summary
+
+def __run_day(used_date: str, data_folder: str, recompute: bool, workers: int, by_components: bool,
+              shard_window: int = None) -> (dict, dict):
+    # run_day(), with a shard_window [sec] it also returns the boundaries of the day for stitch_shards() (else None)
     # The steps are according to the algorithm in section 6 of the paper.
     # Before starting the stuff from scratch (to generate new lists), make sure to unzip the data folders.
     # step 0.a: specify the data to load
-    dates_lst = ["2023_10_01", "2023_10_24", "2023_11_15", "2023_12_18", "2024_01_04", "2024_03_09", "2024_03_16"]
-    used_date = dates_lst[0]  # change the number to load the other days: [0-6]
-    load_folder = "data/data_"+used_date
-    safe_file = "data/dis_appearing_lsts_"+used_date+".json"
+    start_time = time.time()
+    load_folder = data_folder+"/data_"+used_date
+    safe_file = data_folder+"/dis_appearing_lsts_"+used_date+".npz"  # new lists are stored in the compact format
+    json_safe_file = data_folder+"/dis_appearing_lsts_"+used_date+".json"  # the lists of the paper
+    # the street network and the street distance cache are in the data folder as well (see pathfinder.py)
+    graph_file = data_folder+"/"+os.path.basename(pathfinder.DEFAULT_GRAPH_FILE)
+    dist_cache_file = data_folder+"/"+os.path.basename(pathfinder.DEFAULT_DIST_CACHE_FILE)
+    summary = {'date': used_date}
+    edge_snapshots = (None, None)  # the first and the last snapshot of the day, only for the shard boundaries
+    telemetry.reset(label=used_date)
     print(f"load: {load_folder}")
 
-    # step 0.b: load the data and calculate the appearing/disappearing scooters, then store them in a file
-    # all_day = dataloader.load_all_files(load_folder)
-    # all_day = sanitize_data(all_day)
-    # appearing_lst, disappearing_lst = make_appearing_disappearing_lists(all_day)  # this step takes some time ~1.5h
-    # safe_appearing_disappearing_lists(appearing_lst, disappearing_lst, safe_file)
-
-    # step 0.c: if the file is already available, you can simply load it (saves a lot of time)
-    appearing_lst, disappearing_lst = load_appearing_disappearing_lists(safe_file)
+    if not recompute and not os.path.isfile(safe_file) and os.path.isfile(json_safe_file):
+        safe_file = json_safe_file
+    if recompute or not os.path.isfile(safe_file):
+        # step 0.b: load the data and calculate the appearing/disappearing scooters, then store them in a file
+        with telemetry.stage("load"):
+            recordings_lst, id_lst = dataloader.load_all_files_cached(load_folder, workers=workers)
+            all_day = dataloader.columnar_2_observations(recordings_lst, id_lst)
+        with telemetry.stage("make_appearing_disappearing_lists"):
+            appearing_lst, disappearing_lst = make_appearing_disappearing_lists(all_day, workers=workers)  # this step takes some minutes
+        safe_appearing_disappearing_lists(appearing_lst, disappearing_lst, safe_file)
+        if len(all_day) > 0:
+            edge_snapshots = (all_day[0], all_day[-1])
+    else:
+        # step 0.c: if the file is already available, you can simply load it (saves a lot of time)
+        with telemetry.stage("load_appearing_disappearing_lists"):
+            appearing_lst, disappearing_lst = load_appearing_disappearing_lists(safe_file)
+        if shard_window is not None and os.path.isdir(load_folder):
+            first_and_last = sanitize_data(dataloader.load_first_and_last_file(load_folder))
+            if len(first_and_last) == 2:
+                edge_snapshots = (first_and_last[0], first_and_last[1])
 
     # step 1: remove loading scooters over any time period (ok... step 1 from the paper is included in step 2 in the
     #         code, but this is something else we can filter out before)
-    appearing_lst, disappearing_lst = remove_loading_scooters(appearing_lst, disappearing_lst, verbose=True)
+    with telemetry.stage("remove_loading_scooters"):
+        appearing_lst, disappearing_lst = remove_loading_scooters(appearing_lst, disappearing_lst, verbose=True)
+    summary['appearing_scooters'] = sum([len(scooters) for _, scooters in appearing_lst])
+    summary['disappearing_scooters'] = sum([len(scooters) for _, scooters in disappearing_lst])
 
     # step 2: find all possible trip candidates, based on the constraints (max 2h, max 17km/h, ...)
-    trip_candidates_lst = find_scooter_trip_candidates(appearing_lst, disappearing_lst, verbose=True)
+    with telemetry.stage("find_scooter_trip_candidates"):
+        trip_candidates_lst = find_scooter_trip_candidates(appearing_lst, disappearing_lst, verbose=True)
     print("")
     print(f"mid-term evaluation (how many trips were easy to identify, what is the remaining potential):")
-    evaluation.print_trip_candidates_statistics(trip_candidates_lst)
+    summary['mid_term_statistics'] = evaluation.print_trip_candidates_statistics(trip_candidates_lst)
 
     # steps 3-6: identify the trips where only one possible end-candidate is available
-    trips_identified, trip_candidates_lst = utilities.find_trips_by_stable_state(trip_candidates_lst, verbose=True)
+    with telemetry.stage("find_trips_by_stable_state"):
+        if by_components:
+            trips_identified, trip_candidates_lst, component_stats = utilities.find_trips_by_components(trip_candidates_lst, verbose=True, workers=workers)
+            summary['components'] = component_stats
+        else:
+            trips_identified, trip_candidates_lst = utilities.find_trips_by_stable_state(trip_candidates_lst, verbose=True)
+    summary['trips_identified'] = len(trips_identified)
+    summary['multi_end_remaining'] = len(trip_candidates_lst)
+    boundaries = None
+    if shard_window is not None:
+        boundaries = __make_shard_boundaries(used_date, appearing_lst, disappearing_lst, edge_snapshots,
+                                             trips_identified, shard_window)
 
     # evaluate the results
     print("")
     print(f"final evaluation (part 1/2):")
     trip_candidates_lst.extend(trips_identified)  # combine them to have all together for the overfiew
-    evaluation.print_trip_candidates_statistics(trip_candidates_lst)
-    evaluation.print_trip_distances(trips_identified, dist=0.5)
+    summary['final_statistics'] = evaluation.print_trip_candidates_statistics(trip_candidates_lst)
+    summary['trip_distances'] = evaluation.print_trip_distances(trips_identified, dist=0.5)
 
     # compare to ground_truth_tips
     print("")
     print(f"final evaluation (part 2/2: load fresh data, identify all events, compare the found trips):")
-    all_day = dataloader.load_all_files(load_folder)
-    trips, relocations, roundtrips, loadings, rest = trip_extractor_full_data.identify_trips_full_data(all_day)
-    print(f"trips:")
-    evaluation.print_validation_estimatedOneEnd_vs_real_by_IDs(trips_identified, trips)
-    print(f"re-locations:")
-    evaluation.print_validation_estimatedOneEnd_vs_real_by_IDs(trips_identified, relocations)
-    print(f"round-trips:")
-    evaluation.print_validation_estimatedOneEnd_vs_real_by_IDs(trips_identified, roundtrips)
-    print(f"loadings:")
-    evaluation.print_validation_estimatedOneEnd_vs_real_by_IDs(trips_identified, loadings)
-    print(f"undefined:")
-    evaluation.print_validation_estimatedOneEnd_vs_real_by_IDs(trips_identified, rest)
+    if os.path.isdir(load_folder):
+        with telemetry.stage("load"):
+            recordings_lst, id_lst = dataloader.load_all_files_cached(load_folder, workers=workers)  # from the cache
+            all_day = dataloader.columnar_2_dicts(recordings_lst, id_lst)
+        with telemetry.stage("identify_trips_full_data"):
+            trips, relocations, roundtrips, loadings, rest = trip_extractor_full_data.identify_trips_full_data(
+                all_day, graph_file=graph_file, cache_file=dist_cache_file)
+        summary['validation'] = {}
+        print(f"trips:")
+        summary['validation']['trips'] = evaluation.print_validation_estimatedOneEnd_vs_real_by_IDs(trips_identified, trips)
+        print(f"re-locations:")
+        summary['validation']['relocations'] = evaluation.print_validation_estimatedOneEnd_vs_real_by_IDs(trips_identified, relocations)
+        print(f"round-trips:")
+        summary['validation']['roundtrips'] = evaluation.print_validation_estimatedOneEnd_vs_real_by_IDs(trips_identified, roundtrips)
+        print(f"loadings:")
+        summary['validation']['loadings'] = evaluation.print_validation_estimatedOneEnd_vs_real_by_IDs(trips_identified, loadings)
+        print(f"undefined:")
+        summary['validation']['undefined'] = evaluation.print_validation_estimatedOneEnd_vs_real_by_IDs(trips_identified, rest)
+    else:
+        print(f"no raw data folder {load_folder} (unzip it first), skip the ground-truth comparison")
+        summary['validation'] = None
+    summary['runtime'] = time.time() - start_time  # [sec]
+    if telemetry.is_enabled():
+        summary['telemetry'] = telemetry.get_report()
+    return summary, boundaries
+
+def __run_day_safe(used_date: str, data_folder: str, recompute: bool, workers: int, by_components: bool,
+                   shard_window: int = None) -> (dict, dict):
+    # __run_day(), but a failing day does not stop the other days: the traceback is printed (into the log of the day)
+    # and the summary only contains the error, the boundaries are None
+    try:
+        return __run_day(used_date, data_folder, recompute, workers, by_components, shard_window=shard_window)
+    except Exception as error:
+        traceback.print_exc(file=sys.stdout)
+        return {'date': used_date, 'error': f"{type(error).__name__}: {error}"}, None
+
+def __print_day_summary(summary: dict):
+    if 'error' in summary:
+        print(f"{summary['date']}: failed: {summary['error']}")
+    else:
+        print(f"{summary['date']}: trips_identified: {summary['trips_identified']}, runtime: {summary['runtime']:.1f}s")
+
+def __run_day_logged(day_args: (str, str, bool, int, bool, str)) -> dict:
+    # for the process pool: run_day() with the output written into output_dir/<date>.log
+    used_date, data_folder, recompute, workers, by_components, output_dir = day_args
+    with open(os.path.join(output_dir, used_date+".log"), 'w') as log_file:
+        with contextlib.redirect_stdout(log_file):
+            summary, _ = __run_day_safe(used_date, data_folder, recompute, workers, by_components)
+            return summary
+
+# sharded mode: every day is processed on its own (one shard), then the transitions between consecutive days are
+# stitched. a trip crosses the boundary only if it starts in the last SHARD_WINDOW of the old day and ends in the first
+# SHARD_WINDOW of the new day (the maximal duration of a trip), so only these parts of the shards are kept.
+SHARD_WINDOW = 2*3600  # [sec]
+
+def __make_shard_boundaries(used_date: str, appear_lst: [(int, [Observation])], disappear_lst: [(int, [Observation])],
+                            edge_snapshots: ((int, [Observation]), (int, [Observation])),
+                            trips_identified: [(Observation, [Observation])], shard_window: int) -> dict:
+    # the parts of one day that are needed to stitch it with the previous and the next day (after the loading scooters
+    # were removed). first_snapshot / last_snapshot are None if the raw data was not available.
+    first_snapshot, last_snapshot = edge_snapshots
+    first_time = disappear_lst[0][0] if len(disappear_lst) > 0 else None  # the first pair starts with the first snapshot
+    last_time = appear_lst[-1][0] if len(appear_lst) > 0 else None
+    boundaries = {'date': used_date, 'first_time': first_time, 'last_time': last_time,
+                  'first_snapshot': first_snapshot, 'last_snapshot': last_snapshot,
+                  'head_appear': [], 'tail_disappear': [], 'used_starts': set(), 'used_ends': set()}
+    if first_time is None:
+        return boundaries
+    boundaries['head_appear'] = [(timestamp, scooters) for timestamp, scooters in appear_lst if timestamp <= first_time + shard_window]
+    boundaries['tail_disappear'] = [(timestamp, scooters) for timestamp, scooters in disappear_lst if timestamp >= last_time - shard_window]
+    # the observations in the windows that are already part of a trip of this day
+    for start_scooter, end_scooters_lst in trips_identified:
+        if start_scooter.collection_timestamp_utc >= last_time - shard_window:
+            boundaries['used_starts'].add(utilities.scooter_2_key(start_scooter))
+        if end_scooters_lst[0].collection_timestamp_utc <= first_time + shard_window:
+            boundaries['used_ends'].add(utilities.scooter_2_key(end_scooters_lst[0]))
+    return boundaries
+
+def stitch_shards(old_boundaries: dict, new_boundaries: dict, shard_window: int = SHARD_WINDOW, verbose: bool = False) -> ([(Observation, [Observation])], [(Observation, [Observation])], dict):
+    # re-examines the transition between two consecutive shards: the scooters that disappeared in the last shard_window
+    # of the old day, the scooters that appeared in the first shard_window of the new day and the snapshot-pair across
+    # the boundary (last snapshot of the old day, first snapshot of the new day; only if the raw data was available).
+    # only trips across the boundary are searched, observations that are already part of a trip of one of the shards
+    # are left out. returns the trips, the remaining multi-end candidates and a summary.
+    summary = {'from': old_boundaries['date'], 'to': new_boundaries['date'], 'stitched': False}
+    last_time = old_boundaries['last_time']
+    first_time = new_boundaries['first_time']
+    if last_time is None or first_time is None or not (0 < first_time - last_time <= shard_window):
+        return [], [], summary  # not consecutive, no trip can cross the boundary
+    disappear_lst = [(timestamp, scooters[:]) for timestamp, scooters in old_boundaries['tail_disappear']]
+    appear_lst = [(timestamp, scooters[:]) for timestamp, scooters in new_boundaries['head_appear']]
+    if old_boundaries['last_snapshot'] is not None and new_boundaries['first_snapshot'] is not None:
+        (time1, lst1), (time2, lst2) = old_boundaries['last_snapshot'], new_boundaries['first_snapshot']
+        disappeared, appeared = process_snapshot_pair(time1, lst1, time2, lst2, verbose=verbose)
+        disappear_lst.append(disappeared)
+        appear_lst.insert(0, appeared)
+        summary['boundary_pair'] = {'disappeared': len(disappeared[1]), 'appeared': len(appeared[1])}
+    appear_lst, disappear_lst = remove_loading_scooters(appear_lst, disappear_lst, verbose=verbose)
+    summary['stitched'] = True
+    summary['disappearing_scooters'] = sum([len(scooters) for _, scooters in disappear_lst])
+    summary['appearing_scooters'] = sum([len(scooters) for _, scooters in appear_lst])
+    trip_candidates_lst = []
+    if len(appear_lst) > 0 and len(disappear_lst) > 0:
+        trip_candidates_lst = find_scooter_trip_candidates(appear_lst, disappear_lst, verbose=verbose)
+    # the disappear snapshots are all before the appear snapshots, so every candidate crosses the boundary
+    used_starts = old_boundaries['used_starts']
+    used_ends = new_boundaries['used_ends']
+    crossing_candidates_lst = []
+    for start_scooter, end_scooters_lst in trip_candidates_lst:
+        if utilities.scooter_2_key(start_scooter) in used_starts:
+            continue
+        end_scooters_lst = [end_scooter for end_scooter in end_scooters_lst if utilities.scooter_2_key(end_scooter) not in used_ends]
+        if len(end_scooters_lst) > 0:
+            crossing_candidates_lst.append((start_scooter, end_scooters_lst))
+    summary['crossing_candidates'] = len(crossing_candidates_lst)
+    trips_identified, multi_end_lst = utilities.find_trips_by_stable_state(crossing_candidates_lst, verbose=verbose)
+    summary['trips_identified'] = len(trips_identified)
+    summary['multi_end_remaining'] = len(multi_end_lst)
+    if len(crossing_candidates_lst) > 0:
+        summary['final_statistics'] = evaluation.print_trip_candidates_statistics(multi_end_lst + trips_identified)
+    return trips_identified, multi_end_lst, summary
+
+def __run_day_shard_logged(day_args: (str, str, bool, int, bool, str, int)) -> (dict, dict):
+    # for the process pool: one shard of run_days_sharded() with the output written into output_dir/<date>.log
+    used_date, data_folder, recompute, workers, by_components, output_dir, shard_window = day_args
+    with open(os.path.join(output_dir, used_date+".log"), 'w') as log_file:
+        with contextlib.redirect_stdout(log_file):
+            return __run_day_safe(used_date, data_folder, recompute, workers, by_components, shard_window=shard_window)
+
+def run_days_sharded(dates_lst: [str], data_folder: str = "data", recompute: bool = False, workers: int = 1,
+                     stage_workers: int = 1, by_components: bool = False, output_dir: str = "results",
+                     shard_window: int = SHARD_WINDOW) -> ([dict], [dict]):
+    # processes every day as one shard (workers days in parallel, each with stage_workers processes), then stitches the
+    # transitions between consecutive days as soon as both shards are done. only the boundaries of the last finished
+    # shard are kept in memory. the output of every day goes into output_dir/<date>.log, the output of the stitching
+    # into output_dir/<from>_<to>.log. returns the summaries of the days and of the boundaries. a failed day has only an
+    # error in its summary, the transitions to its neighbours are not stitched.
+    dates_lst = sorted(set(dates_lst))
+    day_args_lst = [(date, data_folder, recompute, stage_workers, by_components, output_dir, shard_window) for date in dates_lst]
+    summaries = []
+    boundary_summaries = []
+    with contextlib.ExitStack() as stack:
+        if workers > 1 and len(dates_lst) > 1:
+            executor = stack.enter_context(ProcessPoolExecutor(max_workers=workers))
+            results = executor.map(__run_day_shard_logged, day_args_lst)
+        else:
+            results = map(__run_day_shard_logged, day_args_lst)
+        previous_boundaries = None
+        for summary, boundaries in results:
+            summaries.append(summary)
+            __print_day_summary(summary)
+            if previous_boundaries is not None and boundaries is not None:
+                log_name = os.path.join(output_dir, f"{previous_boundaries['date']}_{boundaries['date']}.log")
+                with open(log_name, 'w') as log_file, contextlib.redirect_stdout(log_file):
+                    _, _, boundary_summary = stitch_shards(previous_boundaries, boundaries, shard_window, verbose=True)
+                boundary_summaries.append(boundary_summary)
+                if boundary_summary['stitched']:
+                    print(f"{boundary_summary['from']} -> {boundary_summary['to']}: trips_identified: {boundary_summary['trips_identified']}")
+            previous_boundaries = boundaries
+    return summaries, boundary_summaries
+
+def __dates_from_glob(pattern: str) -> [str]:
+    # the dates (YYYY_MM_DD) of all data folders or list-files that match the pattern, e.g. "data/data_2023_1*"
+    dates = set()
+    for path in glob.glob(pattern):
+        match = re.search(r"(\d{4}_\d{2}_\d{2})", os.path.basename(os.path.normpath(path)))
+        if match is not None:
+            dates.add(match.group(1))
+    return sorted(dates)
+
+def __date_is_available(used_date: str, data_folder: str, recompute: bool) -> bool:
+    # a day needs its data folder or (without recompute) one of its list-files, see __run_day()
+    if os.path.isdir(data_folder+"/data_"+used_date):
+        return True
+    return not recompute and (os.path.isfile(data_folder+"/dis_appearing_lsts_"+used_date+".npz") or
+                              os.path.isfile(data_folder+"/dis_appearing_lsts_"+used_date+".json"))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Identify the trips without using the scooter-IDs (section 6 of the paper) for one or more days.")
+    parser.add_argument("--dates", nargs="+", default=None, help=f"the days to process (YYYY_MM_DD), default: {PAPER_DATES[0]}, 'paper' for all seven days of the paper")
+    parser.add_argument("--glob", default=None, help="process all days whose data folder or list-file matches the pattern, e.g. 'data/data_2023_*'")
+    parser.add_argument("--data-folder", default="data", help="folder with the data_<date> folders and dis_appearing_lsts_<date>.json files")
+    parser.add_argument("--output-dir", default="results", help="folder for the summary (<date>.json) of every day")
+    parser.add_argument("--workers", type=int, default=1, help="number of days that are processed in parallel (their output goes into <output-dir>/<date>.log)")
+    parser.add_argument("--stage-workers", type=int, default=1, help="number of processes for loading the data and the snapshot-pairs of one day")
+    parser.add_argument("--by-components", action="store_true", help="resolve the connected components of the trip candidates independently (with --stage-workers processes) and store their statistics")
+    parser.add_argument("--telemetry", action="store_true", help="add the runtime and peak-memory of every stage, the snapshot-pair timings and the candidate statistics to the summary")
+    parser.add_argument("--telemetry-memory", action="store_true", help="also trace the python allocations of every stage (tracemalloc, slows the stages down), implies --telemetry")
+    parser.add_argument("--profile-dir", default=None, help="also write a cProfile dump of every stage into this folder (<date>/<stage>.prof), implies --telemetry")
+    parser.add_argument("--recompute", action="store_true", help="calculate the appearing/disappearing lists from the raw data, even if the file exists")
+    parser.add_argument("--sharded", action="store_true", help="also find the trips across midnight: process the days independently, then stitch consecutive days (<output-dir>/<from>_<to>.json)")
+    args = parser.parse_args()
+
+    dates_lst = []
+    if args.dates is not None:
+        for date in args.dates:
+            dates_lst.extend(PAPER_DATES if date == "paper" else [date])
+    if args.glob is not None:
+        dates_lst.extend(__dates_from_glob(args.glob))
+    if len(dates_lst) == 0:
+        dates_lst = [PAPER_DATES[0]]
+    missing_dates = [date for date in dates_lst if not __date_is_available(date, args.data_folder, args.recompute)]
+    if len(missing_dates) > 0:
+        parser.error(f"no data folder {args.data_folder}/data_<date>{'' if args.recompute else ' and no list-file'} for: {', '.join(missing_dates)}")
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.telemetry or args.telemetry_memory or args.profile_dir is not None:
+        telemetry.enable(memory=args.telemetry_memory, profile_dir=args.profile_dir)
 
+    if args.sharded:
+        summaries, boundary_summaries = run_days_sharded(dates_lst, data_folder=args.data_folder, recompute=args.recompute,
+                                                         workers=args.workers, stage_workers=args.stage_workers,
+                                                         by_components=args.by_components, output_dir=args.output_dir)
+        for summary in summaries:
+            with open(os.path.join(args.output_dir, summary['date']+".json"), 'w') as summary_file:
+                json.dump(summary, summary_file, indent=2)
+        for boundary_summary in boundary_summaries:
+            with open(os.path.join(args.output_dir, f"{boundary_summary['from']}_{boundary_summary['to']}.json"), 'w') as summary_file:
+                json.dump(boundary_summary, summary_file, indent=2)
+    elif args.workers > 1 and len(dates_lst) > 1:
+        day_args_lst = [(date, args.data_folder, args.recompute, args.stage_workers, args.by_components, args.output_dir) for date in dates_lst]
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            summaries = executor.map(__run_day_logged, day_args_lst)
+            for summary in summaries:
+                __print_day_summary(summary)
+                with open(os.path.join(args.output_dir, summary['date']+".json"), 'w') as summary_file:
+                    json.dump(summary, summary_file, indent=2)
+    else:
+        for date in dates_lst:
+            summary, _ = __run_day_safe(date, args.data_folder, args.recompute, args.stage_workers, args.by_components)
+            __print_day_summary(summary)
+            with open(os.path.join(args.output_dir, summary['date']+".json"), 'w') as summary_file:
+                json.dump(summary, summary_file, indent=2)
@@ -0,0 +1,114 @@
+import math
+import operator
+import numpy as np
+import geopy.distance
+
+
+# mean earth radius [km]
+EARTH_RADIUS_KM = 6371.0088
+# the haversine distance (sphere) differs from the geodesic distance (WGS-84 ellipsoid, used by geopy) by less than 0.6%.
+# so when the haversine distance is used as a cheap pre-filter, the thresholds are widened by this factor (+ 1mm for
+# floating point noise). the surviving pairs are always re-checked with the exact geodesic distance.
+HAVERSINE_TOLERANCE = 1.01
+HAVERSINE_EPSILON = 0.000001  # 1mm [km]
+
+
+def geodetic_locations_2_dist(coord1_lat: float, coord1_long: float, coord2_lat: float, coord2_long: float) -> float:
+    # https://stackoverflow.com/questions/19412462/getting-distance-between-two-points-based-on-latitude-longitude
+    coords_1 = (coord1_lat, coord1_long)
+    coords_2 = (coord2_lat, coord2_long)
+    distance = geopy.distance.geodesic(coords_1, coords_2).km
+    return distance
+
+def prefilter_threshold(threshold: float) -> float:
+    # the haversine-threshold that keeps all pairs with a geodesic distance below threshold [km]
+    return threshold * HAVERSINE_TOLERANCE + HAVERSINE_EPSILON
+
+def dist_bounds(dist_approx: float) -> (float, float):
+    # the range [low, high] of the geodesic distance [km] for a haversine distance [km]
+    dist_low = max((dist_approx - HAVERSINE_EPSILON) / HAVERSINE_TOLERANCE, 0)
+    dist_high = dist_approx * HAVERSINE_TOLERANCE + HAVERSINE_EPSILON
+    return dist_low, dist_high
+
+def haversine_dist(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    # haversine distance [km] between two points (cheap, but only an approximation of the geodesic distance)
+    lat1, lng1, lat2, lng2 = math.radians(lat1), math.radians(lng1), math.radians(lat2), math.radians(lng2)
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1)))
+
+def scooters_2_arrays(scooters: list, keys: [str]) -> dict[str, np.ndarray]:
+    # convert a list of scooters (dicts or dataloader.Observation records) into one numpy array per requested attribute
+    arrays = {}
+    for key in keys:
+        if len(scooters) > 0 and isinstance(scooters[0], dict):
+            arrays[key] = np.array([scooter[key] for scooter in scooters])
+        else:
+            arrays[key] = np.array(list(map(operator.attrgetter(key), scooters)))
+    return arrays
+
+def haversine_matrix(lat1: np.ndarray, lng1: np.ndarray, lat2: np.ndarray, lng2: np.ndarray) -> np.ndarray:
+    # all pairwise haversine distances [km] between the points 1 (rows) and the points 2 (columns)
+    lat1 = np.radians(np.asarray(lat1, dtype=float))[:, None]
+    lng1 = np.radians(np.asarray(lng1, dtype=float))[:, None]
+    lat2 = np.radians(np.asarray(lat2, dtype=float))[None, :]
+    lng2 = np.radians(np.asarray(lng2, dtype=float))[None, :]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+def geodesic_dists(candidate_indices: np.ndarray, lat: float, lng: float, lats: np.ndarray, lngs: np.ndarray) -> np.ndarray:
+    # the exact geodesic distances [km] from one point to the (few) pre-filtered candidates
+    dists = np.empty(len(candidate_indices))
+    for k, j in enumerate(candidate_indices):
+        dists[k] = geodetic_locations_2_dist(lat, lng, lats[j], lngs[j])
+    return dists
+
+# lower bound of the length of one degree latitude (and one degree longitude at the equator) [km]. used to convert a
+# radius into a bounding box of degrees that contains at least all points within that geodesic radius.
+KM_PER_DEGREE_MIN = 110.0
+
+def __radius_2_degrees(lat: float, radius: float) -> (float, float):
+    # returns (delta_lat, delta_lng) [deg] of a bounding box around lat that contains the full radius [km]
+    delta_lat = radius / KM_PER_DEGREE_MIN
+    max_lat = min(abs(lat) + delta_lat, 89.9)
+    delta_lng = radius / (KM_PER_DEGREE_MIN * np.cos(np.radians(max_lat)))
+    return delta_lat, delta_lng
+
+def make_grid_index(lats: np.ndarray, lngs: np.ndarray, cell_size: float = 1.0) -> dict:
+    # spatial hash of points: {(cell_lat, cell_lng): [indices]}, the cells are squares of cell_size [km] in latitude
+    # direction (and the same amount of degrees in longitude direction).
+    cell_deg = cell_size / KM_PER_DEGREE_MIN
+    cells = {}
+    cell_lats = np.floor(np.asarray(lats, dtype=float) / cell_deg).astype(int)
+    cell_lngs = np.floor(np.asarray(lngs, dtype=float) / cell_deg).astype(int)
+    for i in range(len(cell_lats)):
+        key = (int(cell_lats[i]), int(cell_lngs[i]))
+        if key in cells:
+            cells[key].append(i)
+        else:
+            cells[key] = [i]
+    return {'cell_deg': cell_deg, 'cells': cells}
+
+def query_grid_index(grid_index: dict, lat: float, lng: float, radius: float) -> [int]:
+    # returns the sorted indices of all points in the grid cells that touch the bounding box of the radius [km] around
+    # (lat, lng). this is a superset of the points within the geodesic radius, the caller has to check the exact distance.
+    cell_deg = grid_index['cell_deg']
+    cells = grid_index['cells']
+    if len(cells) == 0:
+        return []
+    delta_lat, delta_lng = __radius_2_degrees(lat, radius)
+    lat_min, lat_max = int(np.floor((lat - delta_lat) / cell_deg)), int(np.floor((lat + delta_lat) / cell_deg))
+    lng_min, lng_max = int(np.floor((lng - delta_lng) / cell_deg)), int(np.floor((lng + delta_lng) / cell_deg))
+    indices = []
+    if (lat_max - lat_min + 1) * (lng_max - lng_min + 1) > len(cells):
+        # the box is larger than the occupied area: check the occupied cells instead of all cells in the box
+        for (cell_lat, cell_lng), cell_indices in cells.items():
+            if lat_min <= cell_lat <= lat_max and lng_min <= cell_lng <= lng_max:
+                indices.extend(cell_indices)
+    else:
+        for cell_lat in range(lat_min, lat_max + 1):
+            for cell_lng in range(lng_min, lng_max + 1):
+                cell_indices = cells.get((cell_lat, cell_lng))
+                if cell_indices is not None:
+                    indices.extend(cell_indices)
+    indices.sort()  # keep the original order of the points
+    return indices
@@ -1,3 +1,8 @@
+import os
+import pickle
+import hashlib
+import sqlite3
+
 import osmnx
 import osmnx as ox
 import sklearn  # yes, it is required for ox.distance
@@ -6,6 +11,7 @@ import PyQt5  # is required for ox.plot_graph(G)
 
 import matplotlib.pyplot as plt
 import numpy as np
+import networkx as nx
 
 import pandas as pd
 import geojson
@@ -14,10 +20,135 @@ import geopandas as gpd
 ox.__version__
 
 
-
-def single_trip_dist(dest_lng, dest_lat, start_lng, start_lat):
-    place = "Kaiserslautern"
-    G = ox.graph_from_place(place, network_type="bike")  # vs driving vs walk vs bike
+DEFAULT_PLACE = "Kaiserslautern"
+DEFAULT_NETWORK_TYPE = "bike"  # vs driving vs walk vs bike
+# the street network is stored once with store_model_offline(), afterwards no network access is required
+DEFAULT_GRAPH_FILE = os.path.join("data", "kaiserslautern_bike.graphml")
+
+# in-process cache of the loaded graphs: {absolute_filename: G}
+__graph_cache = {}
+# the versions of the graph files: {absolute_filename: version}
+__graph_versions = {}
+
+# persistent cache of the street distances between two graph nodes, keyed by (orig_node, dest_node, graph_version)
+DEFAULT_DIST_CACHE_FILE = os.path.join("data", "street_dist_cache.sqlite")
+DIST_CACHE_MAX_ENTRIES = 2000000  # the least recently used node pairs are evicted above this size
+# open cache connections: {absolute_filename: connection}
+__dist_cache_connections = {}
+__dist_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def store_model_offline(filename: str = DEFAULT_GRAPH_FILE, place: str = DEFAULT_PLACE,
+                        network_type: str = DEFAULT_NETWORK_TYPE):
+    # download the street network once and store it as GraphML (.graphml) or as pickle (.pickle / .pkl, faster to load)
+    G = ox.graph_from_place(place, network_type=network_type)
+    folder = os.path.dirname(filename)
+    if folder != "" and not os.path.exists(folder):
+        os.makedirs(folder)
+    if filename.endswith(".graphml"):
+        ox.save_graphml(G, filepath=filename)
+    else:
+        with open(filename, "wb") as file:
+            pickle.dump(G, file, protocol=pickle.HIGHEST_PROTOCOL)
+    __graph_cache[os.path.abspath(filename)] = G
+    return G
+
+
+def load_graph(filename: str = DEFAULT_GRAPH_FILE, allow_download: bool = True):
+    # returns the street network from the in-process cache, or loads it from the local file. if the file does not exist,
+    # it is downloaded and stored once (unless allow_download is False, e.g. on workers without network access).
+    key = os.path.abspath(filename)
+    if key in __graph_cache:
+        return __graph_cache[key]
+    if not os.path.exists(filename):
+        if not allow_download:
+            raise FileNotFoundError(f"load_graph: no street network at {filename}, create it with "
+                                    f"'python pathfinder.py --store-graph {filename}'")
+        print(f"load_graph: no street network at {filename}, downloading it once.")
+        return store_model_offline(filename)
+    if filename.endswith(".graphml"):
+        G = ox.load_graphml(filepath=filename)
+    else:
+        with open(filename, "rb") as file:
+            G = pickle.load(file)
+    __graph_cache[key] = G
+    return G
+
+
+def graph_version(filename: str = DEFAULT_GRAPH_FILE) -> str:
+    # the content hash of a graph file, a changed street network never hits the old cached distances
+    key = os.path.abspath(filename)
+    if key not in __graph_versions:
+        sha = hashlib.sha1()
+        with open(filename, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                sha.update(chunk)
+        __graph_versions[key] = sha.hexdigest()
+    return __graph_versions[key]
+
+
+def __open_dist_cache(cache_file: str) -> sqlite3.Connection:
+    key = os.path.abspath(cache_file)
+    if key in __dist_cache_connections:
+        return __dist_cache_connections[key]
+    folder = os.path.dirname(cache_file)
+    if folder != "" and not os.path.exists(folder):
+        os.makedirs(folder)
+    connection = sqlite3.connect(cache_file)
+    connection.execute("CREATE TABLE IF NOT EXISTS street_dist (orig INTEGER, dest INTEGER, version TEXT, "
+                       "dist REAL, last_used INTEGER, PRIMARY KEY (orig, dest, version))")
+    connection.execute("CREATE INDEX IF NOT EXISTS street_dist_last_used ON street_dist (last_used)")
+    connection.commit()
+    __dist_cache_connections[key] = connection
+    return connection
+
+
+def __dist_cache_lookup(connection: sqlite3.Connection, version: str, node_pairs: [(int, int)]) -> dict:
+    # returns {(orig, dest): dist} of the cached node pairs, dist is -1 if there is no route
+    cached = {}
+    for (orig, dest) in node_pairs:
+        row = connection.execute("SELECT dist FROM street_dist WHERE orig=? AND dest=? AND version=?",
+                                 (orig, dest, version)).fetchone()
+        if row is not None:
+            cached[(orig, dest)] = row[0]
+    if len(cached) > 0:
+        (last_used,) = connection.execute("SELECT COALESCE(MAX(last_used), 0) + 1 FROM street_dist").fetchone()
+        connection.executemany("UPDATE street_dist SET last_used=? WHERE orig=? AND dest=? AND version=?",
+                               [(last_used, orig, dest, version) for (orig, dest) in cached])
+        connection.commit()
+    return cached
+
+
+def __dist_cache_store(connection: sqlite3.Connection, version: str, dists: dict, max_entries: int):
+    # dists: {(orig, dest): dist}, evicts the least recently used node pairs if the cache grows above max_entries
+    if len(dists) == 0:
+        return
+    (last_used,) = connection.execute("SELECT COALESCE(MAX(last_used), 0) + 1 FROM street_dist").fetchone()
+    connection.executemany("INSERT OR REPLACE INTO street_dist VALUES (?, ?, ?, ?, ?)",
+                           [(orig, dest, version, dist, last_used) for (orig, dest), dist in dists.items()])
+    (size,) = connection.execute("SELECT COUNT(*) FROM street_dist").fetchone()
+    if size > max_entries:
+        connection.execute("DELETE FROM street_dist WHERE rowid IN "
+                           "(SELECT rowid FROM street_dist ORDER BY last_used LIMIT ?)", (size - max_entries,))
+        __dist_cache_stats['evictions'] += size - max_entries
+    connection.commit()
+
+
+def get_dist_cache_stats() -> dict:
+    # hits / misses count the node pairs (not the location pairs), hit_rate is None before the first lookup
+    stats = dict(__dist_cache_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups > 0 else None
+    return stats
+
+
+def reset_dist_cache_stats():
+    for key in __dist_cache_stats:
+        __dist_cache_stats[key] = 0
+
+
+def single_trip_dist(dest_lng, dest_lat, start_lng, start_lat, graph_file: str = DEFAULT_GRAPH_FILE):
+    G = load_graph(graph_file, allow_download=False)
     #ox.plot_graph(G)
 
     # get the nearest network nodes to two lat/lng points with the distance module
@@ -38,41 +169,84 @@ def single_trip_dist(dest_lng, dest_lat, start_lng, start_lat):
         return dist
 
 
-def many_trip_dist(location_paris_lst: []) -> [float]:
-    # returns a list with distances in meters
-    place = "Kaiserslautern"
-    G = ox.graph_from_place(place, network_type="bike")  # vs driving vs walk vs bike
-    #ox.plot_graph(G)
+def many_trip_dist(location_paris_lst: [], graph_file: str = DEFAULT_GRAPH_FILE, cutoff: float = None,
+                   cache_file: str = DEFAULT_DIST_CACHE_FILE) -> [float]:
+    # returns a list with distances in meters (0 if both locations snap to the same node, -1 if there is no route or
+    # the route is longer than cutoff [m]). the node-to-node distances are cached in cache_file (None: no cache).
+    # the street network is never downloaded here (e.g. on workers without network access), a missing graph_file raises
+    # a FileNotFoundError, create it once with 'python pathfinder.py --store-graph'.
+    G = load_graph(graph_file, allow_download=False)
+    version = graph_version(graph_file) if cache_file is not None else None
+    return batch_trip_dist(G, location_paris_lst, cutoff, cache_file, version)
+
+
+def batch_trip_dist(G, location_paris_lst: [], cutoff: float = None, cache_file: str = None,
+                    version: str = None, max_cache_entries: int = DIST_CACHE_MAX_ENTRIES) -> [float]:
+    # location_paris_lst: [(start_lat, start_lng, dest_lat, dest_lng), ...]
+    # snaps all locations with one nearest-node query, then runs one single-source dijkstra per unique start node. with
+    # a cutoff [m] (e.g. 2h * 17km/h) the search stops early, longer routes are handled like missing routes (-1).
+    # with a cache_file and the graph's version, only the node pairs that are not cached yet are routed.
+    if len(location_paris_lst) == 0:
+        return []
+    pairs = np.array(location_paris_lst, dtype=float)
+    orig_nodes = ox.distance.nearest_nodes(G, X=pairs[:, 1], Y=pairs[:, 0])
+    dest_nodes = ox.distance.nearest_nodes(G, X=pairs[:, 3], Y=pairs[:, 2])
+    node_pairs = set()
+    for i in range(len(pairs)):
+        if orig_nodes[i] != dest_nodes[i]:
+            node_pairs.add((int(orig_nodes[i]), int(dest_nodes[i])))
+    # the exact node-to-node distances [m]: {(orig, dest): dist}, -1 if there is no route
+    node_dists = {}
+    connection = None
+    if cache_file is not None and version is not None:
+        connection = __open_dist_cache(cache_file)
+        node_dists = __dist_cache_lookup(connection, version, node_pairs)
+        __dist_cache_stats['hits'] += len(node_dists)
+        __dist_cache_stats['misses'] += len(node_pairs) - len(node_dists)
+    # group the missing node pairs by their start node: {orig: [dest, ...]}
+    dests_by_orig = {}
+    for (orig, dest) in node_pairs:
+        if (orig, dest) in node_dists:
+            continue
+        if orig in dests_by_orig:
+            dests_by_orig[orig].append(dest)
+        else:
+            dests_by_orig[orig] = [dest]
+    new_dists = {}
+    for orig, dests in dests_by_orig.items():
+        # the edge-lengths are summed up along the shortest path (by distance), like summing up the route's edges
+        dists = nx.single_source_dijkstra_path_length(G, orig, cutoff=cutoff, weight="length")
+        for dest in dests:
+            if dest in dists:
+                new_dists[(orig, dest)] = dists[dest]
+            elif cutoff is None:
+                new_dists[(orig, dest)] = -1  # there is no route at all
+            else:
+                node_dists[(orig, dest)] = -1  # too long (or no route), not cached
+    if connection is not None:
+        __dist_cache_store(connection, version, new_dists, max_cache_entries)
+    node_dists.update(new_dists)
     dist_lst = []
-    for pair in location_paris_lst:
-        start_lat, start_lng, dest_lat, dest_lng  = pair
-
-        # get the nearest network nodes to two lat/lng points with the distance module
-        orig = ox.distance.nearest_nodes(G, Y=start_lat, X=start_lng)
-        dest = ox.distance.nearest_nodes(G, Y=dest_lat, X=dest_lng)
-
+    for i in range(len(pairs)):
+        orig, dest = int(orig_nodes[i]), int(dest_nodes[i])
         if orig == dest:
             dist_lst.append(0)
             continue
-
-        # find the shortest path (by distance) between these nodes then plot it
-        route = ox.shortest_path(G, orig, dest, weight="length")
-        if route is None:
+        dist = node_dists[(orig, dest)]
+        if dist < 0 or (cutoff is not None and dist > cutoff):  # a cached route can be longer than the cutoff
             dist_lst.append(-1)
-            continue
-        # how long is our route in meters?
-        edge_lengths = ox.routing.route_to_gdf(G, route)["length"]
-        dist = round(sum(abs(edge_lengths)))
-        if dist is None:
-            dist = -1
-        dist_lst.append(dist)
+        else:
+            dist_lst.append(round(abs(dist)))
     return dist_lst
 
-#def store_model_offline():
-
-
-
 if __name__ == '__main__':
+    import sys
+    if len(sys.argv) > 1 and sys.argv[1] == "--store-graph":
+        # build-once tool: python pathfinder.py --store-graph [filename]
+        graph_file = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_GRAPH_FILE
+        store_model_offline(graph_file)
+        print(f"stored the street network of {DEFAULT_PLACE} in {graph_file}")
+        sys.exit(0)
     start_loc = (49.453739, 7.811148) # Monte Mare KL
     dest_loc = (49.425696, 7.750943)  # Parking house RPTU
     # google: 6,7 km vs osmx: 6,3 km
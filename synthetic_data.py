@@ -0,0 +1,167 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import random
+import uuid
+import pytz
+from pytz import timezone
+
+
+# generates synthetic snapshot folders in the same format as the collected data (see dataloader.py): one
+# 'vehicles-YYYYMMDD-HHMMSS.json' per snapshot (local time in the filename, lastLocationUpdate / lastStateChange in utc).
+# the scooters are visible while they are parked and invisible while they are used (trip), relocated or charged. the
+# events are also written into 'synthetic_events.json' in the same folder (ignored by the dataloader).
+
+BERLIN = timezone("Europe/Berlin")
+CENTER = (49.4447, 7.7690)  # Kaiserslautern
+KM_PER_DEGREE = 111.32
+
+def __local_2_utc_string(local_time: datetime.datetime) -> str:
+    utc_time = BERLIN.localize(local_time).astimezone(pytz.utc)
+    return utc_time.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+def __move(lat: float, lng: float, dist: float, direction: float) -> (float, float):
+    # moves the location by dist [km] into the direction [rad] (flat-earth approximation, fine for a city)
+    delta_lat = dist * math.cos(direction) / KM_PER_DEGREE
+    delta_lng = dist * math.sin(direction) / (KM_PER_DEGREE * math.cos(math.radians(lat)))
+    return round(lat + delta_lat, 6), round(lng + delta_lng, 6)
+
+def __random_location(rnd: random.Random, center: (float, float), radius: float) -> (float, float):
+    return __move(center[0], center[1], radius * math.sqrt(rnd.random()), rnd.uniform(0, 2 * math.pi))
+
+def __range_meters(battery_level: int) -> int:
+    return int(round(battery_level * 440, -2))  # ~44km with a full battery
+
+def __make_scooter(rnd: random.Random, center: (float, float), radius: float, start_time: datetime.datetime) -> dict:
+    lat, lng = __random_location(rnd, center, radius)
+    battery_level = rnd.randint(20, 100)
+    last_update = start_time - datetime.timedelta(seconds=rnd.randint(60, 12*3600))
+    return {'id': str(uuid.UUID(int=rnd.getrandbits(128), version=4)), 'lat': lat, 'lng': lng,
+            'batteryLevel': battery_level, 'lastLocationUpdate': last_update, 'lastStateChange': last_update,
+            'code': rnd.randint(100000, 999999), 'licencePlate': f"{rnd.randint(100, 999)}{''.join(rnd.choice('ABCDEFGHKLMNPRSTVWXYZ') for _ in range(3))}",
+            'hidden_until': None, 'pending': None}
+
+def __scooter_2_json(scooter: dict) -> dict:
+    return {"type": "vehicle", "id": scooter['id'], "attributes": {
+        "state": "ACTIVE",
+        "lastLocationUpdate": __local_2_utc_string(scooter['lastLocationUpdate']),
+        "lastStateChange": __local_2_utc_string(scooter['lastStateChange']),
+        "batteryLevel": scooter['batteryLevel'],
+        "currentRangeMeters": __range_meters(scooter['batteryLevel']),
+        "lat": scooter['lat'],
+        "lng": scooter['lng'],
+        "maxSpeed": 20,
+        "zoneId": "KAISERSLAUTERN",
+        "code": scooter['code'],
+        "iotVendor": "okai",
+        "licencePlate": scooter['licencePlate'],
+        "isRentable": True,
+        "vehicleType": "escooter",
+        "hasHelmetBox": False,
+        "hasHelmet": False}}
+
+def __start_event(rnd: random.Random, scooter: dict, event_type: str, now: datetime.datetime, center: (float, float),
+                  radius: float) -> dict:
+    # hides the scooter and prepares its state after the event, returns the event for synthetic_events.json
+    lat, lng, battery_level = scooter['lat'], scooter['lng'], scooter['batteryLevel']
+    last_state_change = scooter['lastStateChange']  # renting a scooter is no state-change
+    if event_type == 'trip':
+        duration = rnd.uniform(4, 45) * 60  # [sec]
+        dist = rnd.uniform(6, 16) * duration / 3600 * rnd.uniform(0.5, 0.9)  # beeline [km], slower than the street speed
+        lat, lng = __move(lat, lng, dist, rnd.uniform(0, 2 * math.pi))
+        battery_level = max(1, battery_level - max(0, int(round(dist * 2)) + rnd.randint(-2, 2)))  # ~2% per km
+    elif event_type == 'relocation':
+        duration = rnd.uniform(20, 150) * 60
+        lat, lng = __move(lat, lng, rnd.uniform(0.5, 5), rnd.uniform(0, 2 * math.pi))
+    elif rnd.random() < 0.5:  # charging: battery swap at the same location
+        duration = rnd.uniform(3, 30) * 60
+        battery_level = rnd.randint(90, 100)
+    else:  # charging: picked up, charged and brought back somewhere else
+        duration = rnd.uniform(2, 6) * 3600
+        lat, lng = __random_location(rnd, center, radius)
+        battery_level = rnd.randint(90, 100)
+    end_time = now + datetime.timedelta(seconds=duration)
+    if event_type != 'trip':
+        last_state_change = end_time - datetime.timedelta(seconds=rnd.randint(0, 120))
+    scooter['hidden_until'] = end_time
+    scooter['pending'] = {'lat': lat, 'lng': lng, 'batteryLevel': battery_level,
+                          'lastLocationUpdate': end_time - datetime.timedelta(seconds=rnd.randint(0, 30)),
+                          'lastStateChange': last_state_change}
+    return {'type': event_type, 'id': scooter['id'], 'start': str(now), 'end': str(end_time),
+            'start_location': (scooter['lat'], scooter['lng']), 'end_location': (lat, lng),
+            'start_battery': scooter['batteryLevel'], 'end_battery': battery_level}
+
+def generate_fleet_day(folder: str, fleet_size: int = 300, start: datetime.datetime = datetime.datetime(2023, 10, 1),
+                       hours: float = 24, snapshot_interval: int = 60, trip_rate: float = 0.1,
+                       relocation_rate: float = 0.005, charging_rate: float = 0.01, dropout_rate: float = 0.002,
+                       gps_jitter: float = 5.0, seed: int = 0, center: (float, float) = CENTER, radius: float = 3.0) -> dict:
+    # writes the snapshots of one synthetic fleet into the folder and returns the number of generated events.
+    # fleet_size: number of scooters, start: local time of the first snapshot, hours: recorded time span,
+    # snapshot_interval: [sec] between two snapshots, trip_rate / relocation_rate / charging_rate: events per scooter and
+    # hour, dropout_rate: probability that a parked scooter is missing in one snapshot, gps_jitter: [m] of the occasional
+    # location updates of parked scooters, center / radius: [km] area of the scooters.
+    rnd = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    fleet = [__make_scooter(rnd, center, radius, start) for _ in range(fleet_size)]
+    events = []
+    counts = {'snapshots': 0, 'observations': 0, 'trip': 0, 'relocation': 0, 'charging': 0, 'dropout': 0, 'jitter': 0}
+    event_rates = [('trip', trip_rate), ('relocation', relocation_rate), ('charging', charging_rate)]
+    snapshots = int(hours * 3600 / snapshot_interval)
+    for i in range(snapshots):
+        now = start + datetime.timedelta(seconds=i * snapshot_interval)
+        visible = []
+        for scooter in fleet:
+            if scooter['hidden_until'] is not None:
+                if now < scooter['hidden_until']:
+                    continue
+                scooter.update(scooter['pending'])  # the scooter re-appears after its event
+                scooter['hidden_until'] = None
+                scooter['pending'] = None
+            event_type = None
+            for candidate_type, rate in event_rates:
+                if rnd.random() < rate * snapshot_interval / 3600:
+                    event_type = candidate_type
+                    break
+            if event_type is not None:
+                events.append(__start_event(rnd, scooter, event_type, now, center, radius))
+                counts[event_type] += 1
+                continue
+            if rnd.random() < dropout_rate:  # missing in this snapshot only (e.g. an API hiccup)
+                counts['dropout'] += 1
+                continue
+            if gps_jitter > 0 and rnd.random() < 0.01:  # a parked scooter reports a slightly different location
+                scooter['lat'], scooter['lng'] = __move(scooter['lat'], scooter['lng'], rnd.uniform(0, gps_jitter) / 1000,
+                                                        rnd.uniform(0, 2 * math.pi))
+                scooter['lastLocationUpdate'] = now - datetime.timedelta(seconds=rnd.randint(0, snapshot_interval))
+                counts['jitter'] += 1
+            visible.append(__scooter_2_json(scooter))
+        filename = os.path.join(folder, now.strftime('vehicles-%Y%m%d-%H%M%S.json'))
+        with open(filename, 'w') as json_file:
+            json.dump({"data": visible}, json_file)
+        counts['snapshots'] += 1
+        counts['observations'] += len(visible)
+    with open(os.path.join(folder, "synthetic_events.json"), 'w') as events_file:
+        json.dump(events, events_file)
+    return counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic data folder with vehicles-YYYYMMDD-HHMMSS.json snapshots.")
+    parser.add_argument("folder", help="output folder, e.g. data/data_2030_01_01")
+    parser.add_argument("--fleet-size", type=int, default=300)
+    parser.add_argument("--start", default="2023-10-01T00:00:00", help="local time of the first snapshot")
+    parser.add_argument("--hours", type=float, default=24)
+    parser.add_argument("--snapshot-interval", type=int, default=60, help="[sec]")
+    parser.add_argument("--trip-rate", type=float, default=0.1, help="trips per scooter and hour")
+    parser.add_argument("--relocation-rate", type=float, default=0.005, help="relocations per scooter and hour")
+    parser.add_argument("--charging-rate", type=float, default=0.01, help="charging events per scooter and hour")
+    parser.add_argument("--dropout-rate", type=float, default=0.002, help="probability that a parked scooter is missing in a snapshot")
+    parser.add_argument("--gps-jitter", type=float, default=5.0, help="[m]")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    result = generate_fleet_day(args.folder, fleet_size=args.fleet_size, start=datetime.datetime.fromisoformat(args.start),
+                                hours=args.hours, snapshot_interval=args.snapshot_interval, trip_rate=args.trip_rate,
+                                relocation_rate=args.relocation_rate, charging_rate=args.charging_rate,
+                                dropout_rate=args.dropout_rate, gps_jitter=args.gps_jitter, seed=args.seed)
+    print(result)
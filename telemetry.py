@@ -0,0 +1,150 @@
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+try:
+    import resource  # not available on windows, then there is no peak rss
+except ImportError:
+    resource = None
+
+
+# optional instrumentation of the pipeline: wall-time and peak-memory per stage, timing series (e.g. per snapshot-pair),
+# histograms (e.g. candidate-list sizes) and counters, collected into one json report. it is switched on with
+# enable() or from outside with the environment variables (they are also seen by the worker processes):
+#   SCOOTER_TELEMETRY=1                 collect the report, the memory is the peak rss of the process (cheap)
+#   SCOOTER_TELEMETRY=memory            additionally trace the python allocations per stage with tracemalloc. this
+#                                       slows the stages down (up to 8x), so their wall-times are not representative
+#   SCOOTER_TELEMETRY_PROFILE_DIR=dir   additionally write a cProfile dump of every stage into dir/<label>/<stage>.prof
+#                                       (the label is set by reset(), e.g. the date; repeated stages: <stage>.<n>.prof)
+# when it is switched off, all functions return immediately.
+
+ENV_ENABLED = "SCOOTER_TELEMETRY"
+ENV_PROFILE_DIR = "SCOOTER_TELEMETRY_PROFILE_DIR"
+
+__report = {'stages': {}, 'timings': {}, 'histograms': {}, 'counters': {}}
+__memory_peaks = []  # the running peak memory of the (nested) stages that are currently measured
+__settings = {'label': ""}
+
+
+def enable(memory: bool = False, profile_dir: str = None):
+    # memory: trace the allocations of every stage with tracemalloc (slow, see above)
+    os.environ[ENV_ENABLED] = "memory" if memory else "1"
+    if profile_dir is not None:
+        os.makedirs(profile_dir, exist_ok=True)
+        os.environ[ENV_PROFILE_DIR] = profile_dir
+
+def disable():
+    os.environ.pop(ENV_ENABLED, None)
+    os.environ.pop(ENV_PROFILE_DIR, None)
+
+def is_enabled() -> bool:
+    return os.environ.get(ENV_ENABLED, "0") not in ("", "0")
+
+def __memory_enabled() -> bool:
+    return os.environ.get(ENV_ENABLED, "0") == "memory"
+
+def __max_rss() -> int:
+    # the peak resident set size of this process [byte] (0 if unknown)
+    if resource is None:
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024  # linux: [kB]
+
+def reset(label: str = ""):
+    # clears the collected telemetry, the label names the folder of the cProfile dumps
+    for part in __report.values():
+        part.clear()
+    __settings['label'] = label
+
+@contextlib.contextmanager
+def stage(name: str):
+    # measures the enclosed block as stage 'name' (repeated stages are summed up, nested stages are also measured
+    # as part of the outer stage)
+    if not is_enabled():
+        yield
+        return
+    measure_memory = __memory_enabled()
+    if measure_memory:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if len(__memory_peaks) > 0:  # keep the peak of the outer stage before resetting it
+            __memory_peaks[-1] = max(__memory_peaks[-1], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+        __memory_peaks.append(0)
+        memory_start = tracemalloc.get_traced_memory()[0]
+    max_rss_start = __max_rss()
+    profile_dir = os.environ.get(ENV_PROFILE_DIR)
+    profiler = None
+    if profile_dir is not None:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:  # another profiler is already active (nested stage)
+            profiler = None
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall_time = time.perf_counter() - start_time
+        entry = __report['stages'].setdefault(name, {'calls': 0, 'wall_time': 0.0})
+        entry['calls'] += 1
+        if profiler is not None:
+            profiler.disable()
+            profile_folder = os.path.join(profile_dir, __settings['label'])
+            os.makedirs(profile_folder, exist_ok=True)
+            suffix = "" if entry['calls'] == 1 else f".{entry['calls']}"
+            profiler.dump_stats(os.path.join(profile_folder, f"{name}{suffix}.prof"))
+        entry['wall_time'] += wall_time
+        max_rss = __max_rss()
+        entry['max_rss'] = max(entry.get('max_rss', 0), max_rss)  # [byte] peak rss of the process up to the stage end
+        entry['max_rss_growth'] = entry.get('max_rss_growth', 0) + max_rss - max_rss_start  # [byte] new peaks in the stage
+        if measure_memory:
+            memory_current, memory_peak = tracemalloc.get_traced_memory()
+            memory_peak = max(__memory_peaks.pop(), memory_peak)
+            if len(__memory_peaks) > 0:
+                __memory_peaks[-1] = max(__memory_peaks[-1], memory_peak)
+            else:
+                tracemalloc.stop()
+            entry['peak_memory'] = max(entry.get('peak_memory', 0), memory_peak)  # [byte]
+            entry['memory_delta'] = entry.get('memory_delta', 0) + memory_current - memory_start  # [byte]
+
+def record_timing(name: str, seconds: float):
+    # adds one value to the timing series 'name' (e.g. the duration of every snapshot-pair)
+    if is_enabled():
+        __report['timings'].setdefault(name, []).append(seconds)
+
+def record_histogram(name: str, values: [int]):
+    # adds the values to the histogram 'name': {value: count}
+    if is_enabled():
+        histogram = __report['histograms'].setdefault(name, {})
+        for value in values:
+            histogram[value] = histogram.get(value, 0) + 1
+
+def record_counters(name: str, counters: dict):
+    # adds the counters {counter_name: number} to the counters of 'name'
+    if is_enabled():
+        entry = __report['counters'].setdefault(name, {})
+        for key, value in counters.items():
+            entry[key] = entry.get(key, 0) + value
+
+def __summarize_timings(values: [float]) -> dict:
+    values = sorted(values)
+    return {'count': len(values), 'total': sum(values), 'mean': sum(values) / len(values),
+            'p50': values[len(values) // 2], 'p95': values[min(len(values) - 1, int(len(values) * 0.95))],
+            'max': values[-1]}
+
+def get_report() -> dict:
+    # the collected telemetry (json-serializable). the timing series are summarized (count, total, mean, p50, p95, max)
+    return {'memory_tracing': __memory_enabled(),
+            'stages': {name: dict(entry) for name, entry in __report['stages'].items()},
+            'timings': {name: __summarize_timings(values) for name, values in __report['timings'].items()},
+            'histograms': {name: {str(value): count for value, count in sorted(histogram.items())}
+                           for name, histogram in __report['histograms'].items()},
+            'counters': {name: dict(entry) for name, entry in __report['counters'].items()}}
+
+def write_report(filename: str):
+    with open(filename, 'w') as report_file:
+        json.dump(get_report(), report_file, indent=2)
@@ -20,42 +20,30 @@ def __geodetic_locations_2_dist(coord1_lat: float, coord1_long: float, coord2_la
     distance = geopy.distance.geodesic(coords_1, coords_2).km
     return distance
 
-# 1. get a list of all IDs
-# 2. for each ID go through all times and identify a disappearing-period
-# 3. classify the disappearing-periods if they are a trip
+# 1. go once through all times and identify the disappearing-periods of all IDs
+# 2. classify the disappearing-periods if they are a trip
 
-def identify_trips_full_data(data_lst: [(int, dict)]) -> ([dict], [dict], [dict] ,[dict]):
+def find_disappearing_periods(data_lst: [(int, dict)]) -> [(str, dict, dict)]:
     # data_list: [(utc_timestamp, {scooter_id: {attribute: value}}), (utc_timestamp, {...}), ...]
-    # get a list of all IDs
-    scooter_ids = set([])
-    for (timestamp, scooters_dict) in data_lst:
-        id_lst = list(scooters_dict.keys())
-        id_set = set(id_lst)
-        scooter_ids = scooter_ids.union(id_set)
-    # for each ID go through all times and identify a disappearing-period
+    # one pass over all snapshots: keep the last visible dataset of every ID and if it was visible in the previous
+    # snapshot. when a not visible scooter shows up again, it re-appeared after a disappearing-period.
     disappearing_lst = []  # [(scooter_id, last_dataset_before_disappearing, re_appearing_dataset), ...]
-    for scooter_id in scooter_ids:
-        last_appearing_dataset = None
-        was_visible = False
-        for (timestamp, scooters_dict) in data_lst:
-            id_lst = list(scooters_dict.keys())
-            if last_appearing_dataset is None:
-                if scooter_id in id_lst:  # the id shows up the first time
-                    last_appearing_dataset = scooters_dict[scooter_id]
-                    was_visible = True
-            else:
-                if scooter_id in id_lst and was_visible:  # it was visible, and still is
-                    last_appearing_dataset = scooters_dict[scooter_id]
-                elif scooter_id in id_lst and not was_visible:  # scooter re-appeared
-                    disappearing_lst.append((scooter_id, last_appearing_dataset, scooters_dict[scooter_id]))
-                    last_appearing_dataset = scooters_dict[scooter_id]
-                    was_visible = True
-                elif scooter_id not in id_lst and was_visible:  # it disappeared
-                    was_visible = False
-                elif scooter_id not in id_lst and not was_visible:  # it still is disappeared
-                    was_visible = False
-                else:
-                    print(f"identify_trips_full_data: impossible case?!")
+    last_appearing_datasets = {}  # {scooter_id: last_dataset}
+    previous_visible_ids = set()
+    for (timestamp, scooters_dict) in data_lst:
+        for scooter_id, dataset in scooters_dict.items():
+            if scooter_id in last_appearing_datasets and scooter_id not in previous_visible_ids:  # scooter re-appeared
+                disappearing_lst.append((scooter_id, last_appearing_datasets[scooter_id], dataset))
+            last_appearing_datasets[scooter_id] = dataset
+        previous_visible_ids = set(scooters_dict.keys())
+    return disappearing_lst
+
+def identify_trips_full_data(data_lst: [(int, dict)], graph_file: str = pathfinder.DEFAULT_GRAPH_FILE,
+                             cache_file: str = pathfinder.DEFAULT_DIST_CACHE_FILE) -> ([dict], [dict], [dict] ,[dict]):
+    # data_list: [(utc_timestamp, {scooter_id: {attribute: value}}), (utc_timestamp, {...}), ...]
+    # graph_file / cache_file: the street network and the street distance cache (None: no cache) for the routing
+    # identify the disappearing-periods of all IDs
+    disappearing_lst = find_disappearing_periods(data_lst)  # [(scooter_id, last_dataset_before_disappearing, re_appearing_dataset), ...]
     # according to chapter 6.2.1 get the 'last location update' for calculating the trips duration
     # extract several features to identify a possible trip: beeline_distance, street_distance, duration, battery_change,
     #    street_velocity, beeline_velocity, battery_per_street_dist, battery_per_bee_dist, range_meter_delta
@@ -91,7 +79,7 @@ def identify_trips_full_data(data_lst: [(int, dict)]) -> ([dict], [dict], [dict]
             feature_dict['beeline_bat_change'] = battery_level_change / beeline_dist  # [%/km]
         events_lst.append(feature_dict)
     # calculate the street_dist afterward in a bunch
-    street_dist_lst = pathfinder.many_trip_dist(street_dist_loc_pairs)
+    street_dist_lst = pathfinder.many_trip_dist(street_dist_loc_pairs, graph_file=graph_file, cache_file=cache_file)
     events_lst2 = []
     for i in range(len(street_dist_lst)):
         feature_dict = events_lst[i]
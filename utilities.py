@@ -1,76 +1,180 @@
+import bisect
 import geopy
+from concurrent.futures import ProcessPoolExecutor
 
+import dataloader
+import telemetry
+from dataloader import Observation
 
-def __are_same_scooter_same_collection(scooter1: dict, scooter2: dict) -> bool:
-    return (scooter1['collection_timestamp_utc'] == scooter2['collection_timestamp_utc'] and
-            scooter1['lastLocationUpdate_timestamp'] == scooter2['lastLocationUpdate_timestamp'] and
-            scooter1['lastStateChange_timestamp'] == scooter2['lastStateChange_timestamp'] and
-            scooter1['lat'] == scooter2['lat'] and
-            scooter1['lng'] == scooter2['lng'] and
-            scooter1['batteryLevel'] == scooter2['batteryLevel'])
 
-def __scooter_2_str(scooter) -> str:
-    return (str(scooter['collection_timestamp_utc']) + str(scooter['lastLocationUpdate_timestamp']) +
-            str(scooter['lastStateChange_timestamp']) + str(scooter['lat']) + str(scooter['lng']) +
-            str(scooter['batteryLevel']))
+def scooter_2_key(scooter: Observation) -> tuple:
+    # the fields that identify one observation of a scooter (the same fields __are_same_scooter_same_collection compared)
+    return (scooter.collection_timestamp_utc, scooter.lastLocationUpdate_timestamp,
+            scooter.lastStateChange_timestamp, scooter.lat, scooter.lng, scooter.batteryLevel)
 
-def __reverse_multi_end_list(multi_end_trips: [(dict, [dict])]):
-    # input: [(start_scooter_dict, [list_of_possible_end_scooter_dicts])]
-    # output: [(end_scooter_dict, [list_of_possible_start_scooter_dicts])]
-    end_scooters_dict = {}
+def __make_observation_registry(trip_candidates: [(Observation, [Observation])]) -> ([(int, [int])], [Observation]):
+    # assigns every observation (start and end scooters) a compact integer id, equal observations get the same id.
+    # returns the candidates as [(start_id, [end_ids])] and the observations [Observation] indexed by their id
+    # (scooter-dicts are converted into records).
+    key_2_id = {}
+    observations = []
+    def get_id(scooter: Observation) -> int:
+        if type(scooter) is not Observation:
+            scooter = dataloader.dict_2_observation(scooter)
+        key = scooter_2_key(scooter)
+        observation_id = key_2_id.get(key)
+        if observation_id is None:
+            observation_id = len(observations)
+            key_2_id[key] = observation_id
+            observations.append(scooter)
+        return observation_id
+    int_candidates = []
+    for start_scooter, end_scooters_lst in trip_candidates:
+        int_candidates.append((get_id(start_scooter), [get_id(end_scooter) for end_scooter in end_scooters_lst]))
+    return int_candidates, observations
+
+def __candidates_2_observations(int_candidates: [(int, [int])], observations: [Observation]) -> [(Observation, [Observation])]:
+    return [(observations[start], [observations[end] for end in end_lst]) for start, end_lst in int_candidates]
+
+def __is_same_scooter(scooter1: Observation, scooter2: Observation) -> bool:
+    return scooter1.id == scooter2.id and scooter1.collection_timestamp_utc == scooter2.collection_timestamp_utc
+
+def __reverse_multi_end_list(multi_end_trips: [(int, [int])]) -> [(int, [int])]:
+    # input: [(start_scooter_id, [list_of_possible_end_scooter_ids])]
+    # output: [(end_scooter_id, [list_of_possible_start_scooter_ids])], in the order of the ends first occurrence
+    end_scooters_dict = {}  # {end_id: [start_ids]}
     for start_scooter, end_scooters_lst in multi_end_trips:
         for end_scooter in end_scooters_lst:
-            end_sc_str = __scooter_2_str(end_scooter)
-            if end_sc_str in list(end_scooters_dict.keys()):
-                end_entry, start_lst = end_scooters_dict[end_sc_str]
-            else:
-                end_entry = end_scooter
+            start_lst = end_scooters_dict.get(end_scooter)
+            if start_lst is None:
                 start_lst = []
+                end_scooters_dict[end_scooter] = start_lst
             start_lst.append(start_scooter)
-            end_scooters_dict[end_sc_str] = (end_entry, start_lst)
-    return list(end_scooters_dict.values())
+    return list(end_scooters_dict.items())
+
+def __fenwick_make(values: [int]) -> [int]:
+    # fenwick tree (binary indexed tree) over the values, 1-based internally
+    tree = [0] + list(values)
+    for i in range(1, len(tree)):
+        parent = i + (i & -i)
+        if parent < len(tree):
+            tree[parent] += tree[i]
+    return tree
 
-def __filter_one_end_list(trip_candidates: [(dict, [dict])], verbose: bool = False) -> ([(dict, [dict])], [(dict, [dict])]):
-    # input: [(start_scooter_dict, [list_of_possible_end_scooter_dicts])]
+def __fenwick_add(tree: [int], position: int, delta: int):
+    i = position + 1
+    while i < len(tree):
+        tree[i] += delta
+        i += i & -i
+
+def __fenwick_prefix(tree: [int], position: int) -> int:
+    # sum of the values at the positions [0, position]
+    total = 0
+    i = position + 1
+    while i > 0:
+        total += tree[i]
+        i -= i & -i
+    return total
+
+def __fenwick_kth(tree: [int], k: int) -> int:
+    # the smallest position with a prefix sum of k (the position of the k-th entry, k starts at 1)
+    position = 0
+    step = 1 << (len(tree).bit_length())
+    while step > 0:
+        if position + step < len(tree) and tree[position + step] < k:
+            position += step
+            k -= tree[position]
+        step >>= 1
+    return position
+
+def __filter_one_end_list(trip_candidates: [(int, [int])], observations: [Observation], verbose: bool = False) -> ([(int, [int])], [(int, [int])]):
+    # input: [(start_scooter_id, [list_of_possible_end_scooter_ids])]
+    # repeatedly scan the list from the back: a trip with only one possible end is stored and its end is deleted from all
+    # other candidates (a candidate without any end left is dropped). the scan goes by the index in the shrinking list,
+    # so after deletions it continues at the same index (= rank among the remaining candidates) and restarts at the end
+    # until nothing changes. instead of rescanning, the remaining candidates, the single-end candidates and the
+    # candidates of every end are indexed, so each step jumps directly to the next single-end candidate.
     input_len = len(trip_candidates)
     one_candidate_lst = []
+    alive = __fenwick_make([1] * input_len)  # the remaining candidates
+    singles = __fenwick_make([1 if len(end_lst) == 1 else 0 for _, end_lst in trip_candidates])  # remaining with 1 end
+    alive_count = input_len
+    positions_by_end = {}  # {end_id: {positions of the candidates with this end}}
+    for position, (_, end_lst) in enumerate(trip_candidates):
+        for end in end_lst:
+            if end in positions_by_end:
+                positions_by_end[end].add(position)
+            else:
+                positions_by_end[end] = {position}
+    is_alive = [True] * input_len
     change_happened = True
     while change_happened:
         change_happened = False
-        for i in range(len(trip_candidates)-1, -1, -1):
-            if i >= len(trip_candidates):  # sometimes more than one trip are deleted in one iteration
-                continue
-            candidate = trip_candidates[i]
-            cand_start, cand_end_lst = candidate
-            if len(cand_end_lst) == 1:  # you found a trip with only one possible end. store it
-                change_happened = True
-                del trip_candidates[i]
-                one_candidate_lst.append(candidate)
-                # then go through the rest of the trip_candidates_lst and delete this end-node from all candidates-lists
-                for j in range(len(trip_candidates)-1, -1, -1):
-                    tmp_start, tmp_end_lst = trip_candidates[j]
-                    for k in range(len(tmp_end_lst)-1, -1, -1):
-                        if __are_same_scooter_same_collection(cand_end_lst[0], tmp_end_lst[k]):
-                            if len(tmp_end_lst) == 1:  # if the list already has only one entry and you delete it, there is no end left, so delete the whole entry
-                                if tmp_start['id'] == tmp_end_lst[k]['id']  and tmp_start['collection_timestamp_utc'] == tmp_end_lst[k]['collection_timestamp_utc']:
-                                    print(f"Sanity-Warning: candidate_list_processing deletes a correct full trip")
-                                del trip_candidates[j]
-                                break
-                            else:
-                                if tmp_start['id'] == tmp_end_lst[k]['id'] and tmp_start['collection_timestamp_utc'] == tmp_end_lst[k]['collection_timestamp_utc']:
-                                    print(f"Sanity-Warning: candidate_list_processing deletes a correct endpoint")
-                                del tmp_end_lst[k]
+        i = alive_count - 1  # the index in the (shrinking) list
+        while True:
+            i = min(i, alive_count - 1)  # sometimes more than one trip are deleted in one iteration
+            if i < 0:
+                break
+            # the last single-end candidate with an index <= i
+            single_count = __fenwick_prefix(singles, __fenwick_kth(alive, i + 1))
+            if single_count == 0:
+                break
+            position = __fenwick_kth(singles, single_count)
+            i = __fenwick_prefix(alive, position) - 1
+            # you found a trip with only one possible end. store it
+            change_happened = True
+            candidate = trip_candidates[position]
+            cand_end = candidate[1][0]
+            is_alive[position] = False
+            __fenwick_add(alive, position, -1)
+            __fenwick_add(singles, position, -1)
+            alive_count -= 1
+            one_candidate_lst.append(candidate)
+            # then delete this end-node from all other candidates-lists
+            cand_positions = positions_by_end.pop(cand_end)
+            cand_positions.discard(position)
+            for j in sorted(cand_positions, reverse=True):
+                tmp_start, tmp_end_lst = trip_candidates[j]
+                was_single = len(tmp_end_lst) == 1
+                for k in range(len(tmp_end_lst)-1, -1, -1):
+                    if cand_end == tmp_end_lst[k]:
+                        if len(tmp_end_lst) == 1:  # if the list already has only one entry and you delete it, there is no end left, so delete the whole entry
+                            if __is_same_scooter(observations[tmp_start], observations[tmp_end_lst[k]]):
+                                print(f"Sanity-Warning: candidate_list_processing deletes a correct full trip")
+                            is_alive[j] = False
+                            __fenwick_add(alive, j, -1)
+                            alive_count -= 1
+                            break
+                        else:
+                            if __is_same_scooter(observations[tmp_start], observations[tmp_end_lst[k]]):
+                                print(f"Sanity-Warning: candidate_list_processing deletes a correct endpoint")
+                            del tmp_end_lst[k]
+                is_single = is_alive[j] and len(tmp_end_lst) == 1
+                if was_single != is_single:
+                    __fenwick_add(singles, j, 1 if is_single else -1)
+            i -= 1
+    multi_candidate_lst = [trip_candidates[position] for position in range(input_len) if is_alive[position]]
     if verbose:
-        print(f"input: {input_len}, output: 1-end: {len(one_candidate_lst)}, multi-end: {len(trip_candidates)}")
-    return one_candidate_lst, trip_candidates
+        print(f"input: {input_len}, output: 1-end: {len(one_candidate_lst)}, multi-end: {len(multi_candidate_lst)}")
+    return one_candidate_lst, multi_candidate_lst
 
 
 
-def find_trips_by_stable_state(trip_candidates: [(dict, [dict])], verbose: bool = False) -> ([(dict, [dict])], [(dict, [dict])]):
+def find_trips_by_stable_state(trip_candidates: [(Observation, [Observation])], verbose: bool = False) -> ([(Observation, [Observation])], [(Observation, [Observation])]):
+    one_candidate_lst, multi_ends_lst, iterations = __find_trips_by_stable_state(trip_candidates, verbose)
+    telemetry.record_counters("find_trips_by_stable_state", {'calls': 1, 'iterations': iterations,
+                                                             'single': len(one_candidate_lst), 'multi': len(multi_ends_lst)})
+    return one_candidate_lst, multi_ends_lst
+
+def __find_trips_by_stable_state(trip_candidates: [(Observation, [Observation])], verbose: bool) -> ([(Observation, [Observation])], [(Observation, [Observation])], int):
+    # find_trips_by_stable_state() without the telemetry, also returns the number of iterations (the counters of the
+    # components that are resolved in a process pool are recorded by the parent, see find_trips_by_components())
     one_candidate_lst = []
     input_len = len(trip_candidates)
+    # every observation gets an integer id once, so the reversing and comparing below works on ints
+    trip_candidates, observations = __make_observation_registry(trip_candidates)
     # step 3: find all trips with only one end candidate
-    one_end_lst, multi_ends_lst = __filter_one_end_list(trip_candidates)
+    one_end_lst, multi_ends_lst = __filter_one_end_list(trip_candidates, observations)
     if verbose:
         print(f"input-len: {input_len}, start-iteration: {len(one_end_lst)}/{len(multi_ends_lst)}")
     counter = 0
@@ -80,7 +184,7 @@ def find_trips_by_stable_state(trip_candidates: [(dict, [dict])], verbose: bool
         # step 4: invert the lists (now they are in inverted order)
         multi_start_lst = __reverse_multi_end_list(multi_ends_lst)
         # step 5: repeat step 3: filter trips with only one start (since they are inverted, we find the start here)
-        one_start_lst, multi_start_lst = __filter_one_end_list(multi_start_lst)
+        one_start_lst, multi_start_lst = __filter_one_end_list(multi_start_lst, observations)
         if verbose:
             print(f"   iter {counter}a: single/multi: {len(one_start_lst)}/{len(multi_start_lst)}")
         one_end_lst = __reverse_multi_end_list(one_start_lst)  # to get the correct order, we have to invert them again
@@ -88,13 +192,79 @@ def find_trips_by_stable_state(trip_candidates: [(dict, [dict])], verbose: bool
         # step 5: repeat step 4: invert the list (now the multi-end-list is in the original order)
         multi_ends_lst = __reverse_multi_end_list(multi_start_lst)
         # step 5: repeat step 3: filter trips with only one end
-        one_end_lst, multi_ends_lst = __filter_one_end_list(multi_ends_lst)
+        one_end_lst, multi_ends_lst = __filter_one_end_list(multi_ends_lst, observations)
         if verbose:
             print(f"   iter {counter}b: single/multi: {len(one_end_lst)}/{len(multi_ends_lst)}")
     # step 6: return the lists
     if verbose:
         print(f"   input: {input_len} -> single/multi: {len(one_candidate_lst)}/{len(multi_ends_lst)}")
-    return one_candidate_lst, multi_ends_lst
+    return __candidates_2_observations(one_candidate_lst, observations), __candidates_2_observations(multi_ends_lst, observations), counter
+
+def find_candidate_components(trip_candidates: [(Observation, [Observation])]) -> [[(Observation, [Observation])]]:
+    # splits the candidates into the connected components of the bipartite start/end graph: two candidates are in the
+    # same component if they share an end scooter (directly or over other candidates). the components are ordered by
+    # their first candidate, within a component the candidates keep their order.
+    int_candidates, observations = __make_observation_registry(trip_candidates)
+    parent = list(range(len(observations)))  # union-find over the observation ids
+    def find_root(node: int) -> int:
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+    for start, end_lst in int_candidates:
+        start_root = find_root(start)
+        for end in end_lst:
+            end_root = find_root(end)
+            if end_root != start_root:
+                parent[end_root] = start_root
+    components = {}  # {root: [candidates]}
+    for i, (start, _) in enumerate(int_candidates):
+        root = find_root(start)
+        if root in components:
+            components[root].append(trip_candidates[i])
+        else:
+            components[root] = [trip_candidates[i]]
+    return list(components.values())
+
+def __resolve_component(component: [(Observation, [Observation])]) -> ([(Observation, [Observation])], [(Observation, [Observation])], dict):
+    candidates = len(component)
+    edges = sum([len(end_lst) for _, end_lst in component])
+    one_candidate_lst, multi_ends_lst, iterations = __find_trips_by_stable_state(component, False)
+    component_stats = {'candidates': candidates, 'edges': edges, 'single': len(one_candidate_lst),
+                       'multi': len(multi_ends_lst), 'resolved_fraction': len(one_candidate_lst) / candidates,
+                       'iterations': iterations}
+    return one_candidate_lst, multi_ends_lst, component_stats
+
+def find_trips_by_components(trip_candidates: [(Observation, [Observation])], verbose: bool = False, workers: int = 1) -> ([(Observation, [Observation])], [(Observation, [Observation])], [dict]):
+    # like find_trips_by_stable_state, but every connected component of the candidates is resolved on its own
+    # (with workers > 1 in a process pool). returns the merged single/multi lists and the statistics of every component
+    # {'candidates', 'edges', 'single', 'multi', 'resolved_fraction', 'iterations'} (in the order of the components).
+    # the telemetry counters of find_trips_by_stable_state are recorded here, also for the components of the workers.
+    components = find_candidate_components(trip_candidates)
+    if workers > 1 and len(components) > 1:
+        # the large components first, so they do not end up as the last job of one worker
+        order = sorted(range(len(components)), key=lambda c: -len(components[c]))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(__resolve_component, [components[c] for c in order], chunksize=16))
+        resolved = [None] * len(components)
+        for c, result in zip(order, results):
+            resolved[c] = result
+    else:
+        resolved = [__resolve_component(component) for component in components]
+    one_candidate_lst = []
+    multi_ends_lst = []
+    component_stats = []
+    for one_lst, multi_lst, stats in resolved:
+        one_candidate_lst.extend(one_lst)
+        multi_ends_lst.extend(multi_lst)
+        component_stats.append(stats)
+        telemetry.record_counters("find_trips_by_stable_state", {'calls': 1, 'iterations': stats['iterations'],
+                                                                 'single': stats['single'], 'multi': stats['multi']})
+    if verbose:
+        largest = max(component_stats, key=lambda stats: stats['edges']) if len(component_stats) else None
+        print(f"   components: {len(components)}, largest: {largest}")
+        print(f"   input: {len(trip_candidates)} -> single/multi: {len(one_candidate_lst)}/{len(multi_ends_lst)}")
+    return one_candidate_lst, multi_ends_lst, component_stats
 
 def geodetic_locations_2_dist(coord1_lat: float, coord1_long: float, coord2_lat: float, coord2_long: float) -> float:
     # https://stackoverflow.com/questions/19412462/getting-distance-between-two-points-based-on-latitude-longitude
@@ -103,3 +273,16 @@ def geodetic_locations_2_dist(coord1_lat: float, coord1_long: float, coord2_lat:
     distance = geopy.distance.geodesic(coords_1, coords_2).km
     return distance
 
+def make_time_index(snapshot_lst: [(int, list)]) -> ([int], [int]):
+    # time index of a list of snapshots [(collection_timestamp, [scooters]), ...]: the sorted timestamps and the
+    # positions of the snapshots in the list (in the same order), for bisect-queries with get_time_window()
+    order = sorted(range(len(snapshot_lst)), key=lambda i: snapshot_lst[i][0])
+    timestamps = [snapshot_lst[i][0] for i in order]
+    return timestamps, order
+
+def get_time_window(time_index: ([int], [int]), time_from: float, time_to: float) -> [int]:
+    # returns the positions (in list order) of all snapshots with time_from < timestamp <= time_to
+    timestamps, order = time_index
+    first = bisect.bisect_right(timestamps, time_from)
+    last = bisect.bisect_right(timestamps, time_to)
+    return sorted(order[first:last])